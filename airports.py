@@ -0,0 +1,136 @@
+import csv
+import math
+import os
+import sys
+from array import array
+
+earth_radius = 6371.0 #km
+cell_size = 1.0 #degrees per grid cell
+
+def haversine(latitude1, longitude1, latitude2, longitude2):
+    latitude1, longitude1, latitude2, longitude2 = map(math.radians, (latitude1, longitude1, latitude2, longitude2))
+    a = math.sin((latitude2 - latitude1) / 2) ** 2 + math.cos(latitude1) * math.cos(latitude2) * math.sin((longitude2 - longitude1) / 2) ** 2
+    return 2 * earth_radius * math.asin(min(1.0, math.sqrt(a)))
+
+#local airport table with a lat/lon grid index, answers "k nearest airports within R km"
+#without calling amadeus, results have the same shape as the amadeus airports endpoint
+class AirportIndex:
+    def __init__(self, rows):
+        self.codes = []
+        self.names = []
+        self.cities = []
+        self.states = []
+        self.countries = []
+        self.latitudes = array("d")
+        self.longitudes = array("d")
+        for code, name, city, state, country, latitude, longitude in rows:
+            self.codes.append(code)
+            self.names.append(name)
+            self.cities.append(city)
+            self.states.append(state)
+            self.countries.append(country)
+            self.latitudes.append(float(latitude))
+            self.longitudes.append(float(longitude))
+
+        #grid cell -> row numbers of the airports inside it
+        self.grid = {}
+        for row in range(len(self.codes)):
+            self.grid.setdefault(self.cell(self.latitudes[row], self.longitudes[row]), []).append(row)
+
+    @classmethod
+    def load(cls, path):
+        if not os.path.exists(path):
+            print(f"airport file {path} not found, airport searches will use amadeus")
+            return cls([])
+        with open(path, newline="", encoding="utf-8") as file:
+            reader = csv.reader(file)
+            next(reader, None) #header
+            return cls(reader)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def cell(self, latitude, longitude):
+        return (math.floor(latitude / cell_size), math.floor(longitude / cell_size))
+
+    #row numbers in every grid cell that could hold an airport within radius km
+    def candidates(self, latitude, longitude, radius):
+        lat_span = radius / (math.pi * earth_radius / 180)
+        low_lat = math.floor((latitude - lat_span) / cell_size)
+        high_lat = math.floor((latitude + lat_span) / cell_size)
+        #longitude cells get narrower towards the poles, widen the search to match
+        widest = max(abs(latitude - lat_span), abs(latitude + lat_span))
+        if widest >= 89:
+            lon_cells = range(math.floor(-180 / cell_size), math.ceil(180 / cell_size))
+        else:
+            lon_span = lat_span / math.cos(math.radians(widest))
+            low_lon = math.floor((longitude - lon_span) / cell_size)
+            high_lon = math.floor((longitude + lon_span) / cell_size)
+            if high_lon - low_lon >= 360 / cell_size:
+                lon_cells = range(math.floor(-180 / cell_size), math.ceil(180 / cell_size))
+            else:
+                lon_cells = range(low_lon, high_lon + 1)
+
+        rows = []
+        cells_per_turn = round(360 / cell_size)
+        for lat_cell in range(low_lat, high_lat + 1):
+            for lon_cell in lon_cells:
+                #wrap around the antimeridian
+                lon_cell = (lon_cell + cells_per_turn // 2) % cells_per_turn - cells_per_turn // 2
+                rows.extend(self.grid.get((lat_cell, lon_cell), ()))
+        return rows
+
+    #airports closest to the point, at most limit of them and none further than radius km
+    def nearest(self, latitude, longitude, limit=5, radius=500):
+        latitude = float(latitude)
+        longitude = float(longitude)
+        found = []
+        for row in self.candidates(latitude, longitude, radius):
+            distance = haversine(latitude, longitude, self.latitudes[row], self.longitudes[row])
+            if distance <= radius:
+                found.append((distance, row))
+        found.sort()
+        return [self.airport(row, distance) for distance, row in found[:limit]]
+
+    #format a row like an item in the amadeus airports response
+    def airport(self, row, distance):
+        address = {
+            "cityName": self.cities[row],
+            "countryCode": self.countries[row]
+        }
+        if self.states[row]:
+            address["stateCode"] = self.states[row]
+        return {
+            "type": "location",
+            "subType": "AIRPORT",
+            "name": self.names[row],
+            "detailedName": f"{self.cities[row]}/{self.countries[row]}:{self.names[row]}",
+            "iataCode": self.codes[row],
+            "geoCode": {
+                "latitude": self.latitudes[row],
+                "longitude": self.longitudes[row]
+            },
+            "address": address,
+            "distance": {
+                "value": round(distance),
+                "unit": "KM"
+            }
+        }
+
+#convert the ourairports export (airports.csv from ourairports.com/data) into the csv format used above,
+#keeping large and medium airports with scheduled service and an iata code
+def convert_ourairports(source, destination, types=("large_airport", "medium_airport")):
+    with open(source, newline="", encoding="utf-8") as file, open(destination, "w", newline="", encoding="utf-8") as out:
+        writer = csv.writer(out)
+        writer.writerow(["iata", "name", "city", "state", "country", "latitude", "longitude"])
+        for row in csv.DictReader(file):
+            if row["type"] not in types or row["scheduled_service"] != "yes" or len(row["iata_code"]) != 3:
+                continue
+            #iso_region is "US-NY", the state code is only shown for us airports like the amadeus response
+            state = row["iso_region"].split("-", 1)[-1] if row["iso_country"] == "US" else ""
+            writer.writerow([row["iata_code"], row["name"].upper(), row["municipality"].upper(), state,
+                             row["iso_country"], row["latitude_deg"], row["longitude_deg"]])
+
+if __name__ == "__main__":
+    #python airports.py ourairports.csv data/airports.csv
+    convert_ourairports(sys.argv[1], sys.argv[2])
@@ -0,0 +1,324 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+import requests
+from requests.adapters import HTTPAdapter
+import json_codec
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+#how long each upstream endpoint may be cached, matched by method and url prefix in order
+#stable reference data is kept for days, fares and rates only for minutes
+class Policy:
+    def __init__(self, name, method, prefix, ttl):
+        self.name = name
+        self.method = method
+        self.prefix = prefix
+        self.ttl = ttl
+
+#what the route code needs from a response, whether it came from upstream or a cache tier
+class CachedResponse:
+    def __init__(self, status_code, content, source):
+        self.status_code = status_code
+        self.content = content
+        self.source = source #"memory", "shared" or "upstream"
+
+    def json(self):
+        return json_codec.loads(self.content)
+
+#in-process tier, least recently used entries go first once max_bytes is reached
+class MemoryTier:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.time():
+                self._remove(key)
+                return None
+            self.entries.move_to_end(key)
+            return entry[1], entry[2]
+
+    def set(self, key, status, content, ttl):
+        if len(content) > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (time.time() + ttl, status, content)
+            self.size += len(content)
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+
+    def _remove(self, key):
+        entry = self.entries.pop(key)
+        self.size -= len(entry[2])
+
+    def sweep(self):
+        now = time.time()
+        with self.lock:
+            for key in [key for key, entry in self.entries.items() if entry[0] <= now]:
+                self._remove(key)
+
+#shared tier on disk, one file per key so workers never wait on a common write lock
+#files are written to a temp name and renamed, readers only ever see whole entries
+class DiskTier:
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    #status, content and expiry time of an entry, None when it is missing or expired
+    def get(self, key):
+        try:
+            with open(self.path(key), "rb") as file:
+                expires, status = file.readline().split()
+                expires = float(expires)
+                if expires <= time.time():
+                    return None
+                return int(status), file.read(), expires
+        except (OSError, ValueError):
+            return None
+
+    def set(self, key, status, content, ttl):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp, "wb") as file:
+            file.write(f"{time.time() + ttl} {status}\n".encode())
+            file.write(content)
+        os.replace(temp, path)
+
+    #delete expired files, then the oldest ones while the directory is over max_bytes
+    def sweep(self):
+        now = time.time()
+        files = []
+        for folder, _, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(folder, name)
+                try:
+                    with open(path, "rb") as file:
+                        expires = float(file.readline().split()[0])
+                    stat = os.stat(path)
+                except (OSError, ValueError, IndexError):
+                    continue
+                if expires <= now:
+                    os.remove(path)
+                else:
+                    files.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+#shared tier in redis, expiry is left to redis itself
+class RedisTier:
+    def __init__(self, url):
+        self.client = redis.Redis.from_url(url)
+
+    def get(self, key):
+        pipeline = self.client.pipeline()
+        pipeline.get(f"api_cache:{key}")
+        pipeline.pttl(f"api_cache:{key}")
+        value, remaining = pipeline.execute()
+        #pttl is -2 once the key is gone and -1 for a key without expiry, which this tier never writes
+        if value is None or remaining < 0:
+            return None
+        status, content = value.split(b"\n", 1)
+        return int(status), content, time.time() + remaining / 1000
+
+    def set(self, key, status, content, ttl):
+        self.client.set(f"api_cache:{key}", str(status).encode() + b"\n" + content, ex=max(int(ttl), 1))
+
+    def sweep(self):
+        pass
+
+#per endpoint counters and upstream latency
+class EndpointStats:
+    def __init__(self):
+        self.memory_hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.upstream_seconds = 0.0
+        self.upstream_calls = 0
+        self.bytes = 0
+
+    def as_dict(self):
+        return {
+            "memory_hits": self.memory_hits,
+            "shared_hits": self.shared_hits,
+            "misses": self.misses,
+            "upstream_calls": self.upstream_calls,
+            "upstream_avg_ms": self.upstream_seconds / self.upstream_calls * 1000 if self.upstream_calls else 0.0,
+            "bytes": self.bytes
+        }
+
+#drop-in for the get and post calls the app makes, with a ttl per endpoint,
+#an in-process lru tier in front of a shared disk or redis tier, and stats per endpoint
+class CachedHTTP:
+    def __init__(self, policies, memory_bytes=32 * 1024 * 1024, shared=None, sweep_interval=300, pool_size=32, observer=None):
+        self.policies = policies
+        self.observer = observer #called with endpoint, source, seconds and bytes after every request
+        self.memory = MemoryTier(memory_bytes)
+        self.shared = shared
+        self.stats_by_endpoint = {}
+        self.stats_lock = threading.Lock()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        if sweep_interval:
+            sweeper = threading.Thread(target=self.sweep_forever, args=(sweep_interval,), daemon=True)
+            sweeper.start()
+
+    def policy(self, method, url):
+        for policy in self.policies:
+            if policy.method == method and url.startswith(policy.prefix):
+                return policy
+        return None
+
+    def stats(self, name):
+        with self.stats_lock:
+            return self.stats_by_endpoint.setdefault(name, EndpointStats())
+
+    #cache key from the request itself, headers are left out so api keys never end up in it
+    def key(self, method, url, params, body):
+        request = json.dumps([method, url, sorted((params or {}).items()), body], sort_keys=True, default=str)
+        return hashlib.sha256(request.encode()).hexdigest()
+
+    def get(self, url, params=None, headers=None, timeout=None):
+        return self.request("GET", url, params=params, headers=headers, timeout=timeout)
+
+    def post(self, url, json=None, headers=None, timeout=None):
+        return self.request("POST", url, body=json, headers=headers, timeout=timeout)
+
+    def request(self, method, url, params=None, body=None, headers=None, timeout=None):
+        start = time.perf_counter()
+        policy, stats, key = self.prepare(method, url, params, body)
+        if policy:
+            cached = self.lookup(policy, key, stats)
+            if cached is not None:
+                self.notify(policy, cached, start)
+                return cached
+
+        upstream_start = time.perf_counter()
+        response = self.session.request(method, url, params=params, json=body, headers=headers, timeout=timeout)
+        self.record(stats, time.perf_counter() - upstream_start, response.content)
+        if policy:
+            self.store(policy, key, response.status_code, response.content)
+        response = CachedResponse(response.status_code, response.content, "upstream")
+        self.notify(policy, response, start)
+        return response
+
+    def notify(self, policy, response, start):
+        if self.observer is not None:
+            self.observer(policy.name if policy else "uncached", response.source,
+                          time.perf_counter() - start, len(response.content))
+
+    #policy, stats and cache key of a request, the key is None for endpoints that are not cached
+    def prepare(self, method, url, params, body):
+        policy = self.policy(method, url)
+        stats = self.stats(policy.name if policy else "uncached")
+        key = self.key(method, url, params, body) if policy else None
+        return policy, stats, key
+
+    def lookup(self, policy, key, stats, shared=True):
+        cached = self.memory.get(key)
+        if cached is not None:
+            with self.stats_lock:
+                stats.memory_hits += 1
+            return CachedResponse(cached[0], cached[1], "memory")
+        if shared and self.shared is not None:
+            cached = self.shared_get(key)
+            if cached is not None:
+                with self.stats_lock:
+                    stats.shared_hits += 1
+                #keep it in memory for the rest of its life in the shared tier
+                self.memory.set(key, cached[0], cached[1], cached[2] - time.time())
+                return CachedResponse(cached[0], cached[1], "shared")
+        return None
+
+    #a shared tier that can't be read (redis down or timing out) counts as a miss
+    def shared_get(self, key):
+        try:
+            return self.shared.get(key)
+        except Exception as error:
+            print(f"shared cache read failed: {error}")
+            return None
+
+    def record(self, stats, elapsed, content):
+        with self.stats_lock:
+            stats.misses += 1
+            stats.upstream_calls += 1
+            stats.upstream_seconds += elapsed
+            stats.bytes += len(content)
+
+    #only successful responses are cached, errors are retried next time
+    def store(self, policy, key, status_code, content):
+        if status_code != 200:
+            return
+        self.memory.set(key, status_code, content, policy.ttl)
+        if self.shared is not None:
+            try:
+                self.shared.set(key, status_code, content, policy.ttl)
+            except Exception as error:
+                print(f"shared cache write failed: {error}")
+
+    #keep any other payload in the same tiers, for data the app wants to share between requests
+    def put_blob(self, name, content, ttl):
+        key = hashlib.sha256(f"blob:{name}".encode()).hexdigest()
+        self.memory.set(key, 200, content, ttl)
+        if self.shared is not None:
+            try:
+                self.shared.set(key, 200, content, ttl)
+            except Exception as error:
+                print(f"shared cache write failed: {error}")
+
+    def get_blob(self, name):
+        key = hashlib.sha256(f"blob:{name}".encode()).hexdigest()
+        cached = self.memory.get(key)
+        if cached is None and self.shared is not None:
+            cached = self.shared_get(key)
+        return cached[1] if cached is not None else None
+
+    def sweep_forever(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self.memory.sweep()
+                if self.shared is not None:
+                    self.shared.sweep()
+            except Exception as error:
+                print(f"cache sweep failed: {error}")
+
+    def all_stats(self):
+        with self.stats_lock:
+            return {name: stats.as_dict() for name, stats in self.stats_by_endpoint.items()}
+
+#shared tier from settings: redis when a url is given and the client is installed, else a cache directory
+def shared_tier(redis_url, directory, max_bytes):
+    if redis_url and redis is not None:
+        return RedisTier(redis_url)
+    if redis_url:
+        print("redis is not installed, using the disk cache instead")
+    return DiskTier(directory, max_bytes)
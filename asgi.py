@@ -0,0 +1,35 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+#the asgi server is only worth it with the async views, so they are on unless set otherwise
+os.environ.setdefault("ASYNC_VIEWS", "1")
+
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+from main import app as flask_app
+
+#asgiref's WsgiToAsgi runs the wsgi app thread_sensitive, and under an asgi server that has no sync
+#thread of its own (uvicorn) that is one shared thread, so requests were served one at a time.
+#here every request gets a thread from this pool (ASGI_THREADS sets how many) and its async view runs
+#on a loop of that thread, like under a threaded wsgi server. the views block on the database and on
+#templates between awaits, so running them all on the server loop would serialize the requests again
+executor = ThreadPoolExecutor(max_workers=int(os.environ.get("ASGI_THREADS", 64)), thread_name_prefix="asgi")
+run_wsgi_app = WsgiToAsgiInstance.__dict__["run_wsgi_app"].func
+
+class PooledWsgiToAsgiInstance(WsgiToAsgiInstance):
+    async def __call__(self, scope, receive, send):
+        loop = asyncio.get_running_loop()
+        #the response still goes out on the server loop
+        self.send_from_thread = lambda message: asyncio.run_coroutine_threadsafe(send(message), loop).result()
+        await super().__call__(scope, receive, send)
+
+    async def run_wsgi_app(self, body):
+        self.sync_send = self.send_from_thread
+        await asyncio.get_running_loop().run_in_executor(executor, run_wsgi_app, self, body)
+
+class PooledWsgiToAsgi(WsgiToAsgi):
+    async def __call__(self, scope, receive, send):
+        await PooledWsgiToAsgiInstance(self.wsgi_application, self.duplicate_header_limit)(scope, receive, send)
+
+#run with: uvicorn asgi:app
+app = PooledWsgiToAsgi(flask_app)
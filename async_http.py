@@ -0,0 +1,77 @@
+import asyncio
+import threading
+import time
+import requests
+from api_cache import CachedResponse
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+#an event loop on its own thread shared by every request, so the upstream calls of all
+#in-flight searches are multiplexed over one connection pool instead of a thread each
+class BackgroundLoop:
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+    #start a coroutine on the background loop, the concurrent future can be waited on from any thread
+    def submit(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    #await a coroutine on the background loop from another event loop
+    async def run(self, coroutine):
+        return await asyncio.wrap_future(self.submit(coroutine))
+
+#async version of CachedHTTP, it shares the policies, tiers and stats of the sync client
+#and sends cache misses through a pooled httpx client on the background loop
+class AsyncCachedHTTP:
+    def __init__(self, cached, pool_size=100, timeout=30, background=None):
+        self.cached = cached
+        self.limits = httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+        self.timeout = timeout
+        self.background = background or BackgroundLoop()
+        self.client = None
+
+    async def get(self, url, params=None, headers=None, timeout=None):
+        return await self.request("GET", url, params=params, headers=headers, timeout=timeout)
+
+    async def post(self, url, json=None, headers=None, timeout=None):
+        return await self.request("POST", url, body=json, headers=headers, timeout=timeout)
+
+    #observed here rather than in send, so the observer runs in the caller's request context
+    async def request(self, method, url, params=None, body=None, headers=None, timeout=None):
+        start = time.perf_counter()
+        response = await self.background.run(self.send(method, url, params, body, headers, timeout))
+        self.cached.notify(self.cached.policy(method, url), response, start)
+        return response
+
+    #runs on the background loop, where the client and its connections live
+    async def send(self, method, url, params, body, headers, timeout):
+        policy, stats, key = self.cached.prepare(method, url, params, body)
+        if policy:
+            cached = self.cached.lookup(policy, key, stats, shared=False)
+            if cached is None and self.cached.shared is not None:
+                #disk and redis reads block, keep them off the loop
+                cached = await asyncio.to_thread(self.cached.lookup, policy, key, stats)
+            if cached is not None:
+                return cached
+
+        if self.client is None:
+            self.client = httpx.AsyncClient(limits=self.limits)
+        #requests leaves out headers and params set to None, httpx refuses them
+        headers = {name: value for name, value in (headers or {}).items() if value is not None}
+        params = {name: value for name, value in (params or {}).items() if value is not None}
+        start = time.perf_counter()
+        try:
+            response = await self.client.request(method, url, params=params, json=body, headers=headers,
+                                                 timeout=timeout if timeout is not None else self.timeout)
+        except httpx.HTTPError as error:
+            #callers already handle the requests errors of the sync client
+            raise requests.ConnectionError(str(error)) from error
+        self.cached.record(stats, time.perf_counter() - start, response.content)
+        if policy:
+            await asyncio.to_thread(self.cached.store, policy, key, response.status_code, response.content)
+        return CachedResponse(response.status_code, response.content, "upstream")
@@ -0,0 +1,234 @@
+#drives find_airport, find_tickets, search_hotels and choose_room against the stub upstream apis
+#and reports latency percentiles, throughput and peak memory for each stage
+#every user runs a stage before any user starts the next one, so each stage is measured on its own.
+#users search different dates, so flights and rates miss the api cache while the hotel list is shared
+#with --asgi the app is served by uvicorn through asgi.py and the users talk to it over http
+#python benchmarks/bench_flow.py [--users 40] [--concurrency 8] [--async | --asgi] [--latency 80] [--latency hotel_rates=600] [--json out.json]
+#the stub options are the ones of stub_upstream.py
+import argparse
+import json
+import os
+import re
+import resource
+import socket
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import stub_upstream
+
+#resident memory of this process, sampled while a stage runs
+class MemorySampler:
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.peak = 0
+        self.running = False
+        self.page_size = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+    def rss(self):
+        try:
+            with open("/proc/self/statm") as file:
+                return int(file.read().split()[1]) * self.page_size
+        except OSError:
+            #no /proc, the peak so far is the best there is (kilobytes on linux, bytes on macos)
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            return peak if sys.platform == "darwin" else peak * 1024
+
+    def run(self):
+        while self.running:
+            self.peak = max(self.peak, self.rss())
+            time.sleep(self.interval)
+
+    def __enter__(self):
+        self.peak = self.rss()
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.running = False
+        self.thread.join()
+        self.peak = max(self.peak, self.rss())
+
+def percentile(times, share):
+    return times[min(len(times) - 1, int(share * len(times)))] * 1000 if times else 0.0
+
+#a requests session that answers like the flask test client, for users talking to a real server
+class HttpClient:
+    def __init__(self, base):
+        self.base = base
+        self.session = requests.Session()
+
+    def get(self, path):
+        return self.wrap(self.session.get(self.base + path, allow_redirects=False))
+
+    def post(self, path, data=None):
+        return self.wrap(self.session.post(self.base + path, data=data, allow_redirects=False))
+
+    def wrap(self, response):
+        response.data = response.content
+        response.request.path = response.request.path_url
+        return response
+
+#serves asgi.py with uvicorn on a free port in a background thread
+def start_asgi():
+    import uvicorn
+    import asgi
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(asgi.app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return server, f"http://127.0.0.1:{port}"
+
+#one browser session going through the search flow
+class User:
+    def __init__(self, client, index):
+        self.client = client
+        self.index = index
+        self.trip_id = None
+        self.airports = None
+        self.itinerary_id = None
+        self.hotel_id = None
+
+    def sign_up(self):
+        name = f"bench{self.index}"
+        self.client.post("/register", data={"email": f"{name}@example.com", "password": name, "username": name})
+
+    def find_airport(self):
+        start = date.today() + timedelta(days=30 + self.index)
+        response = self.client.post("/find-airport", data={"start_date": start.isoformat(),
+                                                           "end_date": (start + timedelta(days=7)).isoformat(),
+                                                           "arrival": "New York", "destination": "Los Angeles",
+                                                           "travelers": "1"})
+        self.trip_id = self.find(response, rb'name="id" value="(\d+)"')
+        #the closest airport offered for each city
+        self.airports = (self.find(response, rb'name="arrival".*?<option value="([^"]+)"'),
+                         self.find(response, rb'name="destination".*?<option value="([^"]+)"'))
+        return response
+
+    def find_tickets(self):
+        response = self.client.post("/find-tickets", data={"arrival": self.airports[0], "destination": self.airports[1],
+                                                           "cabin_class": "Economy", "id": self.trip_id})
+        self.itinerary_id = self.find(response, rb'name="itinerary_id" value="([^"]+)"')
+        return response
+
+    def search_hotels(self):
+        response = self.client.post("/search_hotels", data={"trip_id": self.trip_id, "itinerary_id": self.itinerary_id})
+        self.hotel_id = self.find(response, rb'/choose_room/\d+/([^"]+)"')
+        return response
+
+    def choose_room(self):
+        return self.client.get(f"/choose_room/{self.trip_id}/{self.hotel_id}")
+
+    def find(self, response, pattern):
+        found = re.search(pattern, response.data, re.DOTALL)
+        if response.status_code != 200 or found is None:
+            raise RuntimeError(f"{response.request.path} answered {response.status_code} without the next step")
+        return found.group(1).decode()
+
+stages = ["find_airport", "find_tickets", "search_hotels", "choose_room"]
+
+def run_stage(users, stage, concurrency):
+    times = []
+    errors = []
+    lock = threading.Lock()
+
+    def step(user):
+        start = time.perf_counter()
+        try:
+            getattr(user, stage)()
+        except Exception as error:
+            with lock:
+                errors.append(str(error))
+            return None
+        with lock:
+            times.append(time.perf_counter() - start)
+        return user
+
+    with MemorySampler() as memory:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            finished = [user for user in executor.map(step, users) if user is not None]
+        elapsed = time.perf_counter() - start
+    times.sort()
+    result = {
+        "stage": stage,
+        "requests": len(times),
+        "errors": len(errors),
+        "p50_ms": percentile(times, 0.5),
+        "p95_ms": percentile(times, 0.95),
+        "p99_ms": percentile(times, 0.99),
+        "max_ms": times[-1] * 1000 if times else 0.0,
+        "per_second": len(times) / elapsed if elapsed else 0.0,
+        "peak_rss_mb": memory.peak / 1024 / 1024
+    }
+    if errors:
+        print(f"{stage}: {len(errors)} failed, first: {errors[0]}")
+    #users whose step failed have nothing to go on with
+    return result, finished
+
+def main():
+    parser = argparse.ArgumentParser(description="search flow benchmark against stub upstream apis")
+    parser.add_argument("--users", type=int, default=40, help="searches run through the whole flow")
+    parser.add_argument("--concurrency", type=int, default=8, help="searches in flight at the same time")
+    parser.add_argument("--async", dest="async_views", action="store_true", help="serve the searches with the async views")
+    parser.add_argument("--asgi", action="store_true", help="serve the async views with uvicorn through asgi.py")
+    parser.add_argument("--amadeus", action="store_true", help="ask the amadeus stub for airports instead of the local table")
+    parser.add_argument("--json", help="also write the results to this file")
+    stub_upstream.add_arguments(parser)
+    args = parser.parse_args()
+
+    server = stub_upstream.start(args)
+    workdir = tempfile.mkdtemp(prefix="bench_flow")
+    os.environ.update(stub_upstream.environment(server.base))
+    os.environ.update({
+        "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+        "CACHE_DIR": os.path.join(workdir, "api_cache"),
+        "THUMBNAIL_DIR": os.path.join(workdir, "thumbnails"),
+        "FLASK_KEY": "bench",
+        "ASYNC_VIEWS": "1" if args.async_views or args.asgi else "0",
+        "AIRPORT_SOURCE": "amadeus" if args.amadeus else "local"
+    })
+    import main as travel
+
+    if args.asgi:
+        asgi_server, base = start_asgi()
+        users = [User(HttpClient(base), index) for index in range(args.users)]
+    else:
+        users = [User(travel.app.test_client(), index) for index in range(args.users)]
+    for user in users:
+        user.sign_up()
+
+    print(f"{args.users} users, {args.concurrency} at a time, {'async' if travel.serve_async else 'sync'} views"
+          f"{' over asgi' if args.asgi else ''}, "
+          f"stub latency {args.latency or ['0']} jitter {args.jitter:g} ms")
+    print(f"{'stage':<14} {'ok':>5} {'err':>4} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9} {'req/s':>8} {'peak MB':>8}")
+    results = []
+    for stage in stages:
+        result, users = run_stage(users, stage, args.concurrency)
+        results.append(result)
+        print(f"{stage:<14} {result['requests']:>5} {result['errors']:>4} {result['p50_ms']:>9.1f} {result['p95_ms']:>9.1f} "
+              f"{result['p99_ms']:>9.1f} {result['max_ms']:>9.1f} {result['per_second']:>8.1f} {result['peak_rss_mb']:>8.1f}")
+    print(f"upstream calls {dict(sorted(server.upstream.calls.items()))}")
+
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump({"users": args.users, "concurrency": args.concurrency, "async": travel.serve_async, "asgi": args.asgi,
+                       "latency": args.latency, "jitter": args.jitter, "stages": results}, file, indent=2)
+    if args.asgi:
+        asgi_server.should_exit = True
+    server.shutdown()
+
+if __name__ == "__main__":
+    main()
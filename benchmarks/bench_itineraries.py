@@ -0,0 +1,37 @@
+#times the itinerary flattening on a recorded flightapi response
+#record one by uncommenting the tickets.json dump in find_tickets, then run
+#python benchmarks/bench_itineraries.py tickets.json [travelers] [rounds]
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from itineraries import flatten, parse_response
+
+def timed(function, rounds):
+    times = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+    times.sort()
+    return result, times[0] * 1000, times[len(times) // 2] * 1000
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else "tickets.json"
+    travelers = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+    rounds = int(sys.argv[3]) if len(sys.argv) > 3 else 50
+    with open(path) as file:
+        options = json.load(file)
+
+    parsed, parse_best, parse_median = timed(lambda: parse_response(options), rounds)
+    flat, flatten_best, flatten_median = timed(lambda: flatten(parsed.itineraries, parsed.legs, parsed.segments, travelers), rounds)
+
+    print(f"{len(parsed.itineraries)} itineraries, {len(parsed.legs)} legs, {len(parsed.segments)} segments")
+    print(f"parse    best {parse_best:.2f} ms  median {parse_median:.2f} ms")
+    print(f"flatten  best {flatten_best:.2f} ms  median {flatten_median:.2f} ms")
+    print(f"total    median {parse_median + flatten_median:.2f} ms, {len(flat) / ((parse_median + flatten_median) / 1000):.0f} itineraries/s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+#times the json codecs on a liteapi rates response, and finding one hotel in the stored rates
+#python benchmarks/bench_json.py [prices.json] [rounds]
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import json_codec
+
+def timed(function, rounds):
+    times = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+    times.sort()
+    return result, times[0] * 1000, times[len(times) // 2] * 1000
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "prices.json")
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    with open(path, "rb") as file:
+        content = file.read()
+
+    codecs = ["json"] + (["orjson"] if json_codec.orjson is not None else [])
+    print(f"{path}: {len(content) / 1024:.0f} KB")
+    for codec in codecs:
+        json_codec.configure(codec)
+        prices, load_best, load_median = timed(lambda: json_codec.loads(content), rounds)
+        _, dump_best, dump_median = timed(lambda: json_codec.dumps(prices), rounds)
+        records = json_codec.encode_records(prices)
+        hotel_id = list(prices)[len(prices) // 2]
+        _, all_best, all_median = timed(lambda: json_codec.decode_records(records), rounds)
+        _, one_best, one_median = timed(lambda: json_codec.decode_record(records, hotel_id), rounds)
+        print(f"{codec:<7} loads  best {load_best:7.2f} ms  median {load_median:7.2f} ms")
+        print(f"{codec:<7} dumps  best {dump_best:7.2f} ms  median {dump_median:7.2f} ms")
+        print(f"{codec:<7} rates  all {len(prices)} hotels median {all_median:7.2f} ms, one hotel median {one_median:7.3f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+#login throughput of the password hashing methods, one thread and then the offload pool
+#python benchmarks/bench_passwords.py [method ...] [--logins 200]
+#methods default to the old pbkdf2:sha256 setting and scrypt
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from passwords import PasswordHasher
+
+def logins_per_second(function, logins, threads):
+    start = time.perf_counter()
+    if threads == 1:
+        for _ in range(logins):
+            function()
+    else:
+        #each thread stands in for a request thread handing the work to the pool
+        with ThreadPoolExecutor(max_workers=threads) as requests:
+            list(requests.map(lambda _: function(), range(logins)))
+    return logins / (time.perf_counter() - start)
+
+def main():
+    args = sys.argv[1:]
+    logins = 200
+    if "--logins" in args:
+        index = args.index("--logins")
+        logins = int(args[index + 1])
+        del args[index:index + 2]
+    methods = args or ["pbkdf2:sha256", "scrypt"]
+    cores = os.cpu_count() or 1
+
+    print(f"{cores} cores, {logins} logins per run")
+    for method in methods:
+        hasher = PasswordHasher(method=method)
+        stored = hasher.hash_now("correct horse battery staple")
+        verify = lambda: hasher.verify(stored, "correct horse battery staple")
+        single = logins_per_second(verify, logins, 1)
+        pooled = logins_per_second(verify, logins, cores * 4)
+        print(f"{method:<16} {hasher.prefix or 'argon2':<24} 1 thread {single:8.1f}/s   pool {pooled:8.1f}/s   {pooled / cores:8.1f}/s per core")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+#local stand-in for api-ninjas, amadeus, flightapi and liteapi, so the app can be benchmarked without the paid apis
+#hotel rates replay prices.json, hotels and their details are built around its hotel ids,
+#flights replay a recorded flightapi response (see bench_itineraries.py) or a generated one
+#python benchmarks/stub_upstream.py [--port 8900] [--latency 80] [--latency hotel_rates=600] [--jitter 30]
+#    [--flights tickets.json] [--itineraries 300] [--hotels 200] [--prices prices.json]
+#then start the app with the variables it prints
+import argparse
+import json
+import os
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+#variables that point the app at a stub listening on base
+def environment(base):
+    return {
+        "API_NINJAS_URL": f"{base}/api-ninjas/v1",
+        "AMADEUS_BASE_URL": f"{base}/amadeus/v1",
+        "AMADEUS_AUTH_URL": f"{base}/amadeus/v1/security/oauth2/token",
+        "AMADEUS_API_KEY": "stub",
+        "AMADEUS_API_SECRET": "stub",
+        "FLIGHT_API_URL": f"{base}/flightapi",
+        "LITEAPI_URL": f"{base}/liteapi/v3.0"
+    }
+
+#a flightapi roundtrip response with count itineraries between two places, leaving on day
+def flight_options(count, day=datetime(2030, 1, 1), seed=1):
+    rnd = random.Random(seed)
+    codes = ["JFK", "LAX", "ORD", "DFW", "DEN", "ATL", "SFO"]
+    places = [{"id": index, "display_code": code} for index, code in enumerate(codes)]
+    agents = [{"id": f"agent{index}", "name": f"Agent {index}"} for index in range(6)]
+    segments = {}
+    legs = {}
+    start = day.replace(hour=6, minute=0)
+
+    def make_leg(day, origin, destination):
+        stops = rnd.choice([0, 0, 1, 1, 2])
+        route = [origin] + rnd.sample(range(2, len(codes)), stops) + [destination]
+        departure = start + timedelta(days=day, minutes=rnd.randrange(0, 16 * 60, 5))
+        time_now = departure
+        segment_ids = []
+        for here, there in zip(route, route[1:]):
+            arrival = time_now + timedelta(minutes=rnd.randrange(60, 330, 5))
+            segment_id = f"{here}-{there}-{time_now:%m%d%H%M}"
+            segments[segment_id] = {"id": segment_id, "origin_place_id": here, "destination_place_id": there,
+                                    "departure": time_now.isoformat(), "arrival": arrival.isoformat()}
+            segment_ids.append(segment_id)
+            time_now = arrival + timedelta(minutes=rnd.randrange(45, 200, 5))
+        leg_id = "|".join(segment_ids)
+        legs[leg_id] = {"id": leg_id, "origin_place_id": origin, "destination_place_id": destination,
+                        "departure": departure.isoformat(), "arrival": arrival.isoformat(),
+                        "duration": int((arrival - departure).total_seconds() // 60), "stop_count": stops,
+                        "segment_ids": segment_ids}
+        return leg_id
+
+    itineraries = []
+    for index in range(count):
+        leg_ids = [make_leg(0, 0, 1), make_leg(7, 1, 0)]
+        itineraries.append({"id": f"{'--'.join(leg_ids)}-{index}", "leg_ids": leg_ids,
+                            "cheapest_price": {"amount": rnd.randint(150, 1600)},
+                            "pricing_options": [{"agent_ids": [rnd.choice(agents)["id"]], "items": [{"url": f"/book/{index}"}]}]})
+    return {"itineraries": itineraries, "legs": list(legs.values()), "segments": list(segments.values()),
+            "places": places, "agents": agents}
+
+#rates for count hotels, the recorded ones are repeated under new ids when more are asked for
+def hotel_rates(prices, count):
+    recorded = list(prices.values())
+    rates = {}
+    for index in range(count or len(recorded)):
+        rate = recorded[index % len(recorded)]
+        hotel_id = rate["hotelId"] if index < len(recorded) else f"{rate['hotelId']}x{index}"
+        rates[hotel_id] = dict(rate, hotelId=hotel_id)
+    return rates
+
+def hotel_listing(index, hotel_id, latitude, longitude):
+    return {"id": hotel_id, "name": f"Hotel {hotel_id}", "hotelDescription": "<p>A hotel near the center.</p>",
+            "city": "Stub City", "address": f"{index + 1} Main Street", "reviewCount": 40 + index,
+            "rating": round(6 + index % 40 / 10, 1) if index % 4 else 0, "stars": 2 + index % 4,
+            "main_photo": f"https://example.com/hotels/{hotel_id}/main.jpg",
+            "latitude": latitude + (index % 20 - 10) / 200, "longitude": longitude + (index // 20 % 20 - 10) / 200}
+
+def hotel_details(index, hotel_id):
+    facilities = ["WiFi", "Parking", "Pool", "Fitness center", "Restaurant", "Spa"]
+    return {"data": {
+        "id": hotel_id, "name": f"Hotel {hotel_id}", "hotelDescription": "<p>A hotel near the center.</p>",
+        "address": f"{index + 1} Main Street", "checkinCheckoutTimes": {"checkin": "3:00 PM", "checkout": "11:00 AM"},
+        "hotelFacilities": facilities[:2 + index % 5],
+        "hotelImages": [{"url": f"https://example.com/hotels/{hotel_id}/{photo}.jpg"} for photo in range(6)],
+        "policies": [{"description": "No pets allowed"}, {"description": "No smoking"}],
+        "rooms": [{"id": room, "roomName": name, "description": f"{name} room",
+                   "roomAmenities": [{"name": "TV"}, {"name": "Air conditioning"}],
+                   "photos": [{"url": f"https://example.com/hotels/{hotel_id}/room{room}.jpg"}],
+                   "bedTypes": [{"quantity": 1 + room % 2, "bedType": "Queen" if room % 2 else "King"}]}
+                  for room, name in enumerate(["Standard", "Deluxe", "Suite"], start=1)],
+        "sentiment_analysis": {"pros": ["Location", "Staff"], "cons": ["Breakfast"],
+                               "categories": [{"name": "Cleanliness", "rating": 8.2, "description": "Clean rooms"}]}
+    }}
+
+#payloads and latency of every endpoint, shared by the handler threads
+class Upstream:
+    def __init__(self, prices, flights=None, itineraries=300, hotels=0, latency=None, jitter=0.0, seed=1):
+        self.rates = hotel_rates(prices, hotels)
+        self.hotel_ids = list(self.rates)
+        self.positions = {hotel_id: index for index, hotel_id in enumerate(self.hotel_ids)}
+        #a recorded response is replayed as it is, generated ones follow the dates searched
+        self.flights = json.dumps(flights).encode() if flights is not None else None
+        self.itineraries = itineraries
+        self.flights_by_day = {}
+        self.latency = latency or {}
+        self.jitter = jitter
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    #seconds to wait before answering, the endpoint's own latency or the default
+    def delay(self, endpoint):
+        base = self.latency.get(endpoint, self.latency.get("default", 0.0))
+        with self.lock:
+            self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+            spread = self.random.uniform(-self.jitter, self.jitter) if self.jitter else 0.0
+        return max(base + spread, 0.0)
+
+    #endpoint name, status and body of a request, the names match the app's cache policies
+    def answer(self, method, path, query, body):
+        if path.startswith("/api-ninjas/v1/city"):
+            name = query.get("name", ["Stub City"])[0]
+            return "city", 200, [{"name": name, "latitude": 34.05, "longitude": -118.24, "country": "US", "population": 1000000}]
+        if path.startswith("/amadeus/v1/security/oauth2/token"):
+            return "token", 200, {"access_token": "stub", "expires_in": 1799, "token_type": "Bearer"}
+        if path.startswith("/amadeus/v1/reference-data/locations/airports"):
+            latitude = float(query.get("latitude", ["0"])[0])
+            longitude = float(query.get("longitude", ["0"])[0])
+            return "airports", 200, {"data": [{"type": "location", "subType": "AIRPORT", "name": "STUB INTL",
+                                               "detailedName": "STUB/US:STUB INTL", "iataCode": "STB",
+                                               "geoCode": {"latitude": latitude, "longitude": longitude},
+                                               "address": {"cityName": "STUB", "countryCode": "US"},
+                                               "distance": {"value": 10, "unit": "KM"}}]}
+        if path.startswith("/flightapi/"):
+            return "flights", 200, self.flight_response(path)
+        if path.startswith("/liteapi/v3.0/data/hotels"):
+            latitude = float(query.get("latitude", ["0"])[0])
+            longitude = float(query.get("longitude", ["0"])[0])
+            listings = [hotel_listing(index, hotel_id, latitude, longitude) for index, hotel_id in enumerate(self.hotel_ids)]
+            return "hotels", 200, {"data": listings, "hotelIds": self.hotel_ids}
+        if path.startswith("/liteapi/v3.0/data/hotel"):
+            hotel_id = query.get("hotelId", [""])[0]
+            if hotel_id not in self.positions:
+                return "hotel_details", 404, {"error": {"code": 404, "message": "hotel not found"}}
+            return "hotel_details", 200, hotel_details(self.positions[hotel_id], hotel_id)
+        if path.startswith("/liteapi/v3.0/hotels/rates") and method == "POST":
+            hotel_ids = (body or {}).get("hotelIds", [])
+            return "hotel_rates", 200, {"data": [self.rates[hotel_id] for hotel_id in hotel_ids if hotel_id in self.rates]}
+        return "unknown", 404, {"error": f"no stub for {method} {path}"}
+
+    #roundtrip paths are /flightapi/roundtrip/key/from/to/departure/return/...
+    def flight_response(self, path):
+        if self.flights is not None:
+            return self.flights
+        parts = path.split("/")
+        try:
+            day = datetime.strptime(parts[6], "%Y-%m-%d")
+        except (IndexError, ValueError):
+            day = datetime(2030, 1, 1)
+        with self.lock:
+            if day not in self.flights_by_day:
+                self.flights_by_day[day] = json.dumps(flight_options(self.itineraries, day)).encode()
+            return self.flights_by_day[day]
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" #keep-alive, like the real apis
+
+    def handle_request(self, method):
+        url = urlsplit(self.path)
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        #the token endpoint takes a form, the rest json
+        body = json.loads(body) if body and "json" in self.headers.get("Content-Type", "") else None
+        upstream = self.server.upstream
+        endpoint, status, payload = upstream.answer(method, url.path, parse_qs(url.query), body)
+        time.sleep(upstream.delay(endpoint))
+        content = payload if isinstance(payload, bytes) else json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self):
+        self.handle_request("GET")
+
+    def do_POST(self):
+        self.handle_request("POST")
+
+    def log_message(self, format, *args):
+        pass
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256
+
+    def __init__(self, address, upstream):
+        super().__init__(address, Handler)
+        self.upstream = upstream
+
+    @property
+    def base(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+#latency settings like "80" or "hotel_rates=600", in milliseconds
+def parse_latency(values):
+    latency = {}
+    for value in values or []:
+        endpoint, _, milliseconds = value.rpartition("=")
+        latency[endpoint or "default"] = float(milliseconds) / 1000
+    return latency
+
+def add_arguments(parser):
+    parser.add_argument("--latency", action="append", metavar="[ENDPOINT=]MS",
+                        help="upstream latency, for every endpoint or one of city, token, airports, flights, hotels, hotel_details, hotel_rates")
+    parser.add_argument("--jitter", type=float, default=0.0, metavar="MS", help="latency varies by up to this much either way")
+    parser.add_argument("--flights", help="recorded flightapi response to replay")
+    parser.add_argument("--itineraries", type=int, default=300, help="itineraries to generate when no response is recorded")
+    parser.add_argument("--hotels", type=int, default=0, help="hotels to serve, the recorded rates are repeated to get there")
+    parser.add_argument("--prices", default=os.path.join(repo_dir, "prices.json"), help="recorded liteapi rates by hotel id")
+
+#start a stub from parsed arguments in a background thread, port 0 picks a free one
+def start(args, host="127.0.0.1", port=0):
+    with open(args.prices) as file:
+        prices = json.load(file)
+    flights = None
+    if args.flights:
+        with open(args.flights) as file:
+            flights = json.load(file)
+    upstream = Upstream(prices, flights, itineraries=args.itineraries, hotels=args.hotels,
+                        latency=parse_latency(args.latency), jitter=args.jitter / 1000)
+    server = StubServer((host, port), upstream)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description="stub upstream apis for benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    add_arguments(parser)
+    args = parser.parse_args()
+    server = start(args, args.host, args.port)
+    for name, value in environment(server.base).items():
+        print(f"{name}={value}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
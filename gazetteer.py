@@ -0,0 +1,131 @@
+import csv
+import difflib
+import os
+import sys
+import unicodedata
+from array import array
+from bisect import bisect_left
+
+#turn a city name into a lookup key: no accents, punctuation or extra spaces, lower case
+#"São Paulo, Brazil" and "sao paulo" give the same key
+def normalize(name):
+    return clean(name.split(",")[0])
+
+def clean(text):
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    text = "".join(char if char.isalnum() else " " for char in text.lower())
+    return " ".join(text.split())
+
+#what comes after the city name, "Paris, Texas, US" gives ["texas", "us"]
+def qualifiers(name):
+    return [part for part in (clean(part) for part in name.split(",")[1:]) if part]
+
+#offline list of cities used to find a city's location without calling api-ninjas
+#coordinates and populations are kept in typed arrays, names in a sorted key index
+class Gazetteer:
+    def __init__(self, rows, fuzzy_cutoff=0.85):
+        self.names = []
+        self.countries = []
+        self.latitudes = array("f")
+        self.longitudes = array("f")
+        self.populations = array("q")
+        for name, country, latitude, longitude, population in rows:
+            self.names.append(name)
+            self.countries.append(country)
+            self.latitudes.append(float(latitude))
+            self.longitudes.append(float(longitude))
+            self.populations.append(int(population or 0))
+
+        #sorted keys with the matching row number, for exact and prefix search
+        keys = [normalize(name) for name in self.names]
+        order = sorted(range(len(keys)), key=lambda i: keys[i])
+        self.sorted_keys = [keys[i] for i in order]
+        self.sorted_rows = array("l", order)
+
+        #unique keys grouped by first letter, fuzzy matching only looks inside one group
+        self.fuzzy_cutoff = fuzzy_cutoff
+        self.buckets = {}
+        for key in dict.fromkeys(self.sorted_keys):
+            if key:
+                self.buckets.setdefault(key[0], []).append(key)
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        if not os.path.exists(path):
+            print(f"gazetteer file {path} not found, city lookups will use api-ninjas")
+            return cls([], **kwargs)
+        with open(path, newline="", encoding="utf-8") as file:
+            reader = csv.reader(file)
+            next(reader, None) #header
+            return cls(reader, **kwargs)
+
+    def __len__(self):
+        return len(self.names)
+
+    #format a row the same way the api-ninjas city endpoint does
+    def city(self, row):
+        return {
+            "name": self.names[row],
+            "latitude": round(self.latitudes[row], 4),
+            "longitude": round(self.longitudes[row], 4),
+            "country": self.countries[row],
+            "population": self.populations[row]
+        }
+
+    #row numbers of every city whose key starts with prefix
+    def prefix_rows(self, prefix):
+        start = bisect_left(self.sorted_keys, prefix)
+        end = bisect_left(self.sorted_keys, prefix + "\uffff", lo=start)
+        return [self.sorted_rows[i] for i in range(start, end)]
+
+    #cities whose name starts with the given text, largest first
+    def search_prefix(self, text, limit=10):
+        rows = self.prefix_rows(normalize(text))
+        rows.sort(key=lambda row: self.populations[row], reverse=True)
+        return [self.city(row) for row in rows[:limit]]
+
+    def exact_rows(self, key):
+        start = bisect_left(self.sorted_keys, key)
+        rows = []
+        while start < len(self.sorted_keys) and self.sorted_keys[start] == key:
+            rows.append(self.sorted_rows[start])
+            start += 1
+        return rows
+
+    #find a city by name, returns a list shaped like the api-ninjas response or None on a miss
+    #if there is no exact match, the closest spelling is used so small typos still resolve
+    #a qualifier after a comma has to be the country code of the row ("Paris, FR"), anything else
+    #("Paris, Texas", "London, Ontario") is a miss so api-ninjas gets the full name
+    def lookup(self, name, fuzzy=True):
+        key = normalize(name or "")
+        if not key:
+            return None
+        rows = self.exact_rows(key)
+        if not rows and fuzzy:
+            matches = difflib.get_close_matches(key, self.buckets.get(key[0], []), n=1, cutoff=self.fuzzy_cutoff)
+            if matches:
+                rows = self.exact_rows(matches[0])
+        wanted = qualifiers(name)
+        if wanted:
+            rows = [row for row in rows if self.countries[row].lower() in wanted]
+        if not rows:
+            return None
+        #the biggest city with that name is the one people usually mean
+        row = max(rows, key=lambda row: self.populations[row])
+        return [self.city(row)]
+
+#convert a geonames export (cities15000.txt or similar) into the csv format used above
+def convert_geonames(source, destination, min_population=15000):
+    with open(source, encoding="utf-8") as file, open(destination, "w", newline="", encoding="utf-8") as out:
+        writer = csv.writer(out)
+        writer.writerow(["name", "country", "latitude", "longitude", "population"])
+        for line in file:
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) < 15 or int(fields[14] or 0) < min_population:
+                continue
+            writer.writerow([fields[2], fields[8], fields[4], fields[5], fields[14]])
+
+if __name__ == "__main__":
+    #python gazetteer.py cities15000.txt data/cities.csv
+    convert_geonames(sys.argv[1], sys.argv[2])
@@ -0,0 +1,117 @@
+import numpy as np
+
+sort_keys = ("best", "price", "rating", "reviews", "distance")
+#rating and reviews read best from the top, the others from the bottom
+descending_sorts = ("rating", "reviews")
+
+earth_radius = 6371.0 #km
+
+#distance in km from one point to arrays of points
+def haversine(latitude, longitude, latitudes, longitudes):
+    latitude, longitude = np.radians(latitude), np.radians(longitude)
+    latitudes, longitudes = np.radians(latitudes), np.radians(longitudes)
+    a = np.sin((latitudes - latitude) / 2) ** 2 + np.cos(latitude) * np.cos(latitudes) * np.sin((longitudes - longitude) / 2) ** 2
+    return 2 * earth_radius * np.arcsin(np.minimum(1.0, np.sqrt(a)))
+
+#cheapest selling price of one room type
+def room_rate(room_type):
+    return min(rate["retailRate"]["suggestedSellingPrice"][0]["amount"] for rate in room_type["rates"])
+
+#cheapest selling price across every room type of one hotel's rates entry
+def cheapest_rate(prices):
+    return min(room_rate(room_type) for room_type in prices["roomTypes"])
+
+#rating out of 10, hotels without reviews fall back to their stars
+def hotel_rating(listing):
+    if listing.get("rating"):
+        return listing["rating"]
+    if listing.get("stars"):
+        return listing["stars"] * 2
+    return 0
+
+#latitude or longitude of a listing, nan when it is missing or null
+def coordinate(listing, name):
+    value = listing.get(name)
+    return np.nan if value is None else value
+
+#column arrays over the priced hotels of one search, built once so sorting and filtering
+#from the hotels page never walks the api responses again
+class HotelTable:
+    def __init__(self, ids, listings, prices, amenities, latitude, longitude):
+        self.ids = list(ids)
+        count = len(self.ids)
+        self.position = np.arange(count, dtype=np.int32) #liteapi order
+        self.price = np.fromiter((prices[id] for id in self.ids), dtype=np.float64, count=count)
+        self.rating = np.fromiter((hotel_rating(listings[id]) for id in self.ids), dtype=np.float32, count=count)
+        self.reviews = np.fromiter((listings[id].get("reviewCount") or 0 for id in self.ids), dtype=np.int32, count=count)
+        #hotels without coordinates sort last by distance
+        latitudes = np.fromiter((coordinate(listings[id], "latitude") for id in self.ids), dtype=np.float64, count=count)
+        longitudes = np.fromiter((coordinate(listings[id], "longitude") for id in self.ids), dtype=np.float64, count=count)
+        if latitude is None or longitude is None:
+            self.distance = np.full(count, np.inf)
+        else:
+            self.distance = np.nan_to_num(haversine(latitude, longitude, latitudes, longitudes), nan=np.inf)
+        #one column per amenity name, true where the hotel has it
+        names = sorted({name for id in self.ids for name in amenities.get(id, ())})
+        self.amenity_names = np.array(names, dtype=object)
+        code = {name: column for column, name in enumerate(names)}
+        self.amenities = np.zeros((count, len(names)), dtype=bool)
+        for row, id in enumerate(self.ids):
+            for name in amenities.get(id, ()):
+                self.amenities[row, code[name]] = True
+
+    def __len__(self):
+        return len(self.ids)
+
+    #one boolean mask per filter, None means the filter is not used
+    def masks(self, min_price=None, max_price=None, amenities=None, max_distance=None):
+        masks = {}
+        if min_price is not None or max_price is not None:
+            prices = np.ones(len(self), dtype=bool)
+            if min_price is not None:
+                prices &= self.price >= min_price
+            if max_price is not None:
+                prices &= self.price <= max_price
+            masks["price"] = prices
+        if amenities:
+            columns = np.flatnonzero(np.isin(self.amenity_names, list(amenities)))
+            #an amenity no hotel has matches nothing
+            if len(columns) < len(set(amenities)):
+                masks["amenities"] = np.zeros(len(self), dtype=bool)
+            else:
+                masks["amenities"] = self.amenities[:, columns].all(axis=1)
+        if max_distance is not None:
+            masks["distance"] = self.distance <= max_distance
+        return masks
+
+    def combine(self, masks, skip=None):
+        combined = np.ones(len(self), dtype=bool)
+        for name, mask in masks.items():
+            if name != skip:
+                combined &= mask
+        return combined
+
+    #counts for the filter options, amenity counts ignore the amenity filter so the other choices stay visible
+    def facets(self, masks):
+        amenities = self.combine(masks, skip="amenities")
+        selected = self.combine(masks)
+        amenity_counts = self.amenities[amenities].sum(axis=0)
+        return {
+            "amenities": {self.amenity_names[column]: int(count) for column, count in enumerate(amenity_counts)},
+            "price_min": float(self.price[selected].min()) if selected.any() else 0.0,
+            "price_max": float(self.price[selected].max()) if selected.any() else 0.0,
+            "total": int(selected.sum())
+        }
+
+    #row numbers matching the filters in the order asked for
+    def select(self, sort="best", descending=None, **filters):
+        masks = self.masks(**filters)
+        rows = np.flatnonzero(self.combine(masks))
+        if sort not in sort_keys:
+            sort = "best"
+        if descending is None:
+            descending = sort in descending_sorts
+        column = getattr(self, "position" if sort == "best" else sort)[rows]
+        #stable sort so ties keep the liteapi order
+        order = np.argsort(-column if descending else column, kind="stable")
+        return rows[order], masks
@@ -0,0 +1,89 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent.futures import as_completed
+
+#split ids into lists of at most size ids, keeping their order
+def chunks(ids, size):
+    size = max(1, size)
+    return [ids[start:start + size] for start in range(0, len(ids), size)]
+
+#latency of every chunk request, the recent ones are kept for percentiles
+class ChunkStats:
+    def __init__(self, keep=500):
+        self.chunks = 0
+        self.failures = 0
+        self.hotels = 0
+        self.seconds = 0.0
+        self.slowest = 0.0
+        self.recent = deque(maxlen=keep)
+        self.lock = threading.Lock()
+
+    def record(self, seconds, hotels, failed=False):
+        with self.lock:
+            self.chunks += 1
+            self.seconds += seconds
+            self.slowest = max(self.slowest, seconds)
+            self.recent.append(seconds)
+            if failed:
+                self.failures += 1
+            else:
+                self.hotels += hotels
+
+    def stats(self):
+        with self.lock:
+            recent = sorted(self.recent)
+            def percentile(share):
+                return recent[min(len(recent) - 1, int(share * len(recent)))] * 1000 if recent else 0.0
+            return {
+                "chunks": self.chunks,
+                "failures": self.failures,
+                "hotels": self.hotels,
+                "avg_ms": self.seconds / self.chunks * 1000 if self.chunks else 0.0,
+                "p50_ms": percentile(0.5),
+                "p95_ms": percentile(0.95),
+                "max_ms": self.slowest * 1000
+            }
+
+#run fetch(chunk) for every chunk on the executor, returns the futures with their chunks
+def submit_chunks(executor, fetch, ids, chunk_size, stats):
+    def timed(chunk):
+        started = time.perf_counter()
+        try:
+            result = fetch(chunk)
+        except Exception:
+            stats.record(time.perf_counter() - started, len(chunk), failed=True)
+            raise
+        stats.record(time.perf_counter() - started, len(result))
+        return result
+    return {executor.submit(timed, chunk): chunk for chunk in chunks(ids, chunk_size)}
+
+#same for a coroutine fetch, started on a BackgroundLoop so the futures can be waited on
+#from a request's event loop or from a plain thread
+def submit_chunks_async(background, fetch, ids, chunk_size, stats):
+    async def timed(chunk):
+        started = time.perf_counter()
+        try:
+            result = await fetch(chunk)
+        except Exception:
+            stats.record(time.perf_counter() - started, len(chunk), failed=True)
+            raise
+        stats.record(time.perf_counter() - started, len(result))
+        return result
+    return {background.submit(timed(chunk)): chunk for chunk in chunks(ids, chunk_size)}
+
+#yield each chunk's rate entries as soon as it is done, chunks that raised are skipped
+def completed(futures):
+    for future in as_completed(futures):
+        try:
+            yield future.result()
+        except Exception as error:
+            print(f"hotel rates chunk of {len(futures[future])} failed: {error}")
+
+async def completed_async(futures):
+    for future in asyncio.as_completed([asyncio.wrap_future(future) for future in futures]):
+        try:
+            yield await future
+        except Exception as error:
+            print(f"hotel rates chunk failed: {error}")
@@ -0,0 +1,141 @@
+from dataclasses import dataclass, field
+from datetime import datetime
+
+#raised when a response points at a leg or segment it does not contain
+class ItineraryError(Exception):
+    pass
+
+#the parsed parts of a flightapi response, legs and segments here have the same
+#attribute names as the Leg and Segment db rows so both can be flattened the same way
+@dataclass(slots=True)
+class SegmentRecord:
+    id: str
+    departure: datetime
+    arrival: datetime
+    origin_code: str
+    destination_code: str
+
+@dataclass(slots=True)
+class LegRecord:
+    id: str
+    departure: datetime
+    arrival: datetime
+    duration: int
+    stop_count: int
+    segment_ids: list
+
+@dataclass(slots=True)
+class ItineraryRecord:
+    id: str
+    position: int
+    leg_ids: list
+    price: float #total for all travelers
+    agent: str
+    url: str
+
+@dataclass(slots=True)
+class ParsedResponse:
+    segments: dict
+    legs: dict
+    itineraries: list
+
+#what the ticket pages show for one leg and one itinerary
+@dataclass(slots=True)
+class FlatLeg:
+    departure: datetime
+    arrival: datetime
+    duration: int #minutes in the air, layovers taken out
+    stop_count: int
+    origin: str
+    destination: str
+    layovers: list = field(default_factory=list)
+
+@dataclass(slots=True)
+class FlatItinerary:
+    id: str
+    legs: list
+    price: float #per traveler
+    agent: str
+    url: str
+
+#parse every segment and leg of a flightapi response once, timestamps included
+def parse_response(options, base_url=""):
+    place_codes = {place["id"]: place.get("display_code", "") for place in options["places"]}
+    agent_names = {agent["id"]: agent["name"] for agent in options["agents"]}
+
+    segments = {}
+    for segment in options["segments"]:
+        segments[segment["id"]] = SegmentRecord(id=segment["id"],
+                                                departure=datetime.fromisoformat(segment["departure"]),
+                                                arrival=datetime.fromisoformat(segment["arrival"]),
+                                                origin_code=place_codes.get(segment["origin_place_id"], ""),
+                                                destination_code=place_codes.get(segment["destination_place_id"], ""))
+    legs = {}
+    for leg in options["legs"]:
+        legs[leg["id"]] = LegRecord(id=leg["id"],
+                                    departure=datetime.fromisoformat(leg["departure"]),
+                                    arrival=datetime.fromisoformat(leg["arrival"]),
+                                    duration=int(leg["duration"]),
+                                    stop_count=leg["stop_count"],
+                                    segment_ids=leg["segment_ids"])
+    itineraries = []
+    for position, option in enumerate(options["itineraries"]):
+        pricing = option["pricing_options"][0]
+        itineraries.append(ItineraryRecord(id=option["id"],
+                                           position=position,
+                                           leg_ids=option["leg_ids"],
+                                           price=option["cheapest_price"]["amount"],
+                                           agent=agent_names.get(pricing["agent_ids"][0], ""),
+                                           url=base_url + pricing["items"][0]["url"]))
+    return ParsedResponse(segments=segments, legs=legs, itineraries=itineraries)
+
+#work out layovers and time in the air for one leg
+def flatten_leg(leg, segments):
+    layovers = []
+    layover_duration = 0
+    for i in range(0, len(leg.segment_ids) - 1):
+        try:
+            segment1 = segments[leg.segment_ids[i]]
+            segment2 = segments[leg.segment_ids[i + 1]]
+        except KeyError as error:
+            raise ItineraryError(f"missing segment {error}") from None
+        difference = (segment2.departure - segment1.arrival).total_seconds()
+        hours = int(difference // 3600)
+        mins = int((difference % 3600) / 60)
+        layovers.append(f"{hours}h {mins}m layover at {segment1.destination_code}")
+        layover_duration += difference / 60
+
+    first = segments.get(leg.segment_ids[0]) if leg.segment_ids else None
+    last = segments.get(leg.segment_ids[-1]) if leg.segment_ids else None
+    return FlatLeg(departure=leg.departure,
+                   arrival=leg.arrival,
+                   duration=leg.duration - int(layover_duration),
+                   stop_count=leg.stop_count,
+                   origin=first.origin_code if first else "",
+                   destination=last.destination_code if last else "",
+                   layovers=layovers)
+
+#flatten itineraries with any number of legs, each leg is worked out once even when
+#many itineraries share it. itineraries can be ItineraryRecords or Itinerary db rows
+def flatten(itineraries, legs, segments, travelers):
+    flat_legs = {}
+    flat_itineraries = []
+    for itinerary in itineraries:
+        itinerary_legs = []
+        for leg_id in itinerary.leg_ids:
+            if leg_id not in flat_legs:
+                if leg_id not in legs:
+                    raise ItineraryError(f"missing leg {leg_id}")
+                flat_legs[leg_id] = flatten_leg(legs[leg_id], segments)
+            itinerary_legs.append(flat_legs[leg_id])
+        flat_itineraries.append(FlatItinerary(id=itinerary.id,
+                                              legs=itinerary_legs,
+                                              price=itinerary.price / travelers,
+                                              agent=itinerary.agent,
+                                              url=itinerary.url))
+    return flat_itineraries
+
+#parse and flatten a whole flightapi response
+def flatten_response(options, travelers, base_url=""):
+    parsed = parse_response(options, base_url=base_url)
+    return parsed, flatten(parsed.itineraries, parsed.legs, parsed.segments, travelers)
@@ -0,0 +1,119 @@
+import threading
+from collections import OrderedDict
+import numpy as np
+
+sort_keys = ("best", "price", "duration", "departure")
+
+#column arrays over the itineraries of one search, built once so sorting, filtering
+#and facet counts are numpy operations instead of walking dicts on every request
+class ItineraryTable:
+    def __init__(self, itineraries):
+        self.itineraries = itineraries
+        count = len(itineraries)
+        self.position = np.arange(count, dtype=np.int32) #flightapi order
+        self.price = np.fromiter((itinerary.price for itinerary in itineraries), dtype=np.float64, count=count)
+        self.duration = np.fromiter((sum(leg.duration for leg in itinerary.legs) for itinerary in itineraries), dtype=np.int32, count=count)
+        self.departure = np.fromiter((itinerary.legs[0].departure.timestamp() if itinerary.legs else 0 for itinerary in itineraries),
+                                     dtype=np.float64, count=count)
+        #minute of the day the first leg leaves, for time window filters
+        self.departure_minute = np.fromiter((itinerary.legs[0].departure.hour * 60 + itinerary.legs[0].departure.minute if itinerary.legs else 0
+                                             for itinerary in itineraries), dtype=np.int16, count=count)
+        #most stops on any leg of the itinerary
+        self.stops = np.fromiter((max((leg.stop_count for leg in itinerary.legs), default=0) for itinerary in itineraries),
+                                 dtype=np.int16, count=count)
+        agents = [itinerary.agent for itinerary in itineraries]
+        self.agent_names, self.agent = np.unique(np.array(agents, dtype=object), return_inverse=True) if count else (np.array([], dtype=object), np.array([], dtype=np.intp))
+
+    def __len__(self):
+        return len(self.itineraries)
+
+    #rough memory use, the arrays plus an estimate for the itinerary and leg objects
+    def approx_size(self):
+        arrays = (self.position, self.price, self.duration, self.departure, self.departure_minute, self.stops, self.agent)
+        return sum(array.nbytes for array in arrays) + len(self) * 600
+
+    #one boolean mask per filter, None means the filter is not used
+    def masks(self, max_stops=None, agents=None, depart_after=None, depart_before=None, min_price=None, max_price=None):
+        masks = {}
+        if max_stops is not None:
+            masks["stops"] = self.stops <= max_stops
+        if agents:
+            codes = np.flatnonzero(np.isin(self.agent_names, list(agents)))
+            masks["agent"] = np.isin(self.agent, codes)
+        if depart_after is not None or depart_before is not None:
+            window = np.ones(len(self), dtype=bool)
+            if depart_after is not None:
+                window &= self.departure_minute >= depart_after
+            if depart_before is not None:
+                window &= self.departure_minute <= depart_before
+            masks["time"] = window
+        if min_price is not None or max_price is not None:
+            prices = np.ones(len(self), dtype=bool)
+            if min_price is not None:
+                prices &= self.price >= min_price
+            if max_price is not None:
+                prices &= self.price <= max_price
+            masks["price"] = prices
+        return masks
+
+    def combine(self, masks, skip=None):
+        combined = np.ones(len(self), dtype=bool)
+        for name, mask in masks.items():
+            if name != skip:
+                combined &= mask
+        return combined
+
+    #counts for the filter options, each one ignores its own filter so the other choices stay visible
+    def facets(self, masks):
+        stops = self.combine(masks, skip="stops")
+        agent = self.combine(masks, skip="agent")
+        selected = self.combine(masks)
+        stop_counts = np.bincount(self.stops[stops], minlength=3) if len(self) else np.zeros(3, dtype=np.int64)
+        agent_counts = np.bincount(self.agent[agent], minlength=len(self.agent_names)) if len(self) else []
+        return {
+            "stops": {stop: int(count) for stop, count in enumerate(stop_counts)},
+            "agents": {self.agent_names[code]: int(count) for code, count in enumerate(agent_counts)},
+            "price_min": float(self.price[selected].min()) if selected.any() else 0.0,
+            "price_max": float(self.price[selected].max()) if selected.any() else 0.0,
+            "total": int(selected.sum())
+        }
+
+    #row numbers matching the filters in the order asked for
+    def select(self, sort="best", descending=False, **filters):
+        masks = self.masks(**filters)
+        rows = np.flatnonzero(self.combine(masks))
+        if sort not in sort_keys:
+            sort = "best"
+        column = getattr(self, "position" if sort == "best" else sort)[rows]
+        #stable sort so ties keep the flightapi order
+        order = np.argsort(-column if descending else column, kind="stable")
+        return rows[order], masks
+
+    #itineraries for one page of results plus the facet counts
+    def query(self, sort="best", descending=False, offset=0, limit=None, **filters):
+        rows, masks = self.select(sort=sort, descending=descending, **filters)
+        total = len(rows)
+        rows = rows[offset:] if limit is None else rows[offset:offset + limit]
+        return [self.itineraries[row] for row in rows], total, self.facets(masks)
+
+#keeps the tables of recent searches in memory, least recently used ones are dropped first
+class TableCache:
+    def __init__(self, max_searches=64):
+        self.max_searches = max_searches
+        self.tables = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, search_id):
+        with self.lock:
+            table = self.tables.get(search_id)
+            if table is not None:
+                self.tables.move_to_end(search_id)
+            return table
+
+    def put(self, search_id, table):
+        with self.lock:
+            self.tables[search_id] = table
+            self.tables.move_to_end(search_id)
+            while len(self.tables) > self.max_searches:
+                self.tables.popitem(last=False)
+        return table
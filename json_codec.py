@@ -0,0 +1,65 @@
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+#json used for the database columns, api responses and cached blobs.
+#orjson when it is installed, the stdlib otherwise, pick one with configure()
+codec = "orjson" if orjson is not None else "json"
+
+def configure(name):
+    global codec
+    if name in (None, "", "auto"):
+        name = "orjson" if orjson is not None else "json"
+    if name == "orjson" and orjson is None:
+        print("orjson is not installed, using the stdlib json instead")
+        name = "json"
+    if name not in ("orjson", "json"):
+        raise ValueError(f"unknown json codec {name}")
+    codec = name
+
+#text, for sqlalchemy's json_serializer
+def dumps(value):
+    if codec == "orjson":
+        return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS).decode()
+    return json.dumps(value, separators=(",", ":"))
+
+def dumpb(value):
+    if codec == "orjson":
+        return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(value, separators=(",", ":")).encode()
+
+#takes str or bytes
+def loads(data):
+    if codec == "orjson":
+        return orjson.loads(data)
+    return json.loads(data)
+
+#records stored one per line behind their key, so one record can be found and decoded
+#without decoding the others. compact json never has a raw newline in it
+def encode_records(records):
+    lines = [b""]
+    for key, value in records.items():
+        key = str(key)
+        if "\t" in key or "\n" in key:
+            raise ValueError(f"record key {key!r} has a tab or newline")
+        lines.append(key.encode() + b"\t" + dumpb(value))
+    return b"\n".join(lines) + b"\n"
+
+def decode_record(content, key):
+    marker = b"\n" + str(key).encode() + b"\t"
+    start = content.find(marker)
+    if start < 0:
+        return None
+    start += len(marker)
+    return loads(content[start:content.index(b"\n", start)])
+
+def decode_records(content):
+    records = {}
+    for line in content.split(b"\n"):
+        if line:
+            key, value = line.split(b"\t", 1)
+            records[key.decode()] = loads(value)
+    return records
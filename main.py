@@ -1,43 +1,218 @@
-from flask import Flask, render_template, redirect, request, url_for, flash, get_flashed_messages
+from flask import Flask, render_template, stream_template, redirect, request, url_for, flash, get_flashed_messages, get_template_attribute, send_file, g, abort, has_request_context, before_render_template, template_rendered
 from dotenv import load_dotenv
 import os 
 from flask_bootstrap import Bootstrap5
 from datetime import datetime
-from sqlalchemy import ForeignKey, String, Integer, DateTime, JSON, Float
-from sqlalchemy.orm import relationship, DeclarativeBase, Mapped, mapped_column
+from sqlalchemy import event, ForeignKey, String, Integer, DateTime, JSON, Float, insert, update, inspect, text, bindparam, or_, case
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import relationship, DeclarativeBase, Mapped, mapped_column, make_transient_to_detached
 from flask_sqlalchemy import SQLAlchemy
-from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import LoginManager, login_user, logout_user, UserMixin, current_user, login_required
-import requests_cache
-from datetime import datetime
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+import asyncio
+import importlib.util
+from contextlib import contextmanager
 import requests
 import json
+import json_codec
+from token_manager import TokenManager
+from api_cache import CachedHTTP, Policy, shared_tier
+from async_http import AsyncCachedHTTP, httpx
+from gazetteer import Gazetteer
+from airports import AirportIndex
+from metrics import Metrics, size_buckets
+from itineraries import ItineraryError, flatten, flatten_response, parse_response
+from itinerary_query import ItineraryTable, TableCache
+from hotel_query import HotelTable, cheapest_rate, room_rate
+from hotel_rates import ChunkStats, chunks, completed, completed_async, submit_chunks, submit_chunks_async
+from prefetch import Prefetcher
+from passwords import PasswordHasher
+from search_cache import SearchCache
+from thumbnails import Image, ThumbnailStore, fetch_image, make_thumbnail, sign, slots, verify
 
 base_url = 'https://www.skyscanner.com' #for itinerary link
+base_dir = os.path.dirname(os.path.abspath(__file__)) #for local data files
 
 load_dotenv() #load in env file
 
-session = requests_cache.CachedSession('api_cache') #to use a cache for api requests
-
-#gathers API token for Amadeus and saves it on the env file
-def get_token():
-    url = "https://test.api.amadeus.com/v1/security/oauth2/token"
-    headers = {
-        "Content-Type": "application/x-www-form-urlencoded"
-    }
-    data = {
-        "grant_type": "client_credentials",
-        "client_id": f"{os.environ.get("AMADEUS_API_KEY")}",         # Replace with your actual client ID
-        "client_secret": f"{os.environ.get("AMADEUS_API_SECRET")}"  # Replace with your actual client secret
-    }
-
-    response = requests.post(url, headers=headers, data=data)
-
-    # To see the response
-    print(response.status_code)
-    table = response.json()
-    token = table["access_token"]
-    os.environ["AMADEUS_ACCESS_TOKEN"] = token
+#latency of routes, upstream calls, db commits and queries, json columns and templates, read on /metrics.
+#SERVER_TIMING=1 adds a Server-Timing header with where each request spent its time,
+#METRICS_TOKEN keeps /metrics for callers that send it as a bearer token
+metrics = Metrics()
+metrics.describe("http_request_duration_seconds", "time to build the response of a route")
+metrics.describe("upstream_request_duration_seconds", "api calls by endpoint and the cache tier that answered")
+metrics.describe("upstream_response_bytes", "size of the responses fetched from upstream")
+metrics.describe("db_commit_duration_seconds", "session commits")
+metrics.describe("db_query_duration_seconds", "statements sent to the database")
+metrics.describe("db_request_seconds", "time a request spent on statements and commits")
+metrics.describe("db_commits_per_request", "commits a request made")
+metrics.describe("json_column_duration_seconds", "encoding and decoding of json columns")
+metrics.describe("template_render_duration_seconds", "jinja rendering by template, streamed pages include the time spent sending")
+commit_buckets = (0, 1, 2, 3, 5, 10)
+server_timing = os.environ.get("SERVER_TIMING", "0") == "1"
+metrics_token = os.environ.get("METRICS_TOKEN")
+
+#time spent in a phase of the current request, for the per request metrics and the Server-Timing header.
+#work done on other threads (rate chunks, prefetching) is not part of it
+def add_timing(phase, seconds):
+    if has_request_context():
+        timings = g.setdefault("timings", {})
+        timings[phase] = timings.get(phase, 0.0) + seconds
+
+def observe_upstream(endpoint, source, seconds, size):
+    metrics.observe("upstream_request_duration_seconds", seconds, endpoint=endpoint, source=source)
+    if source == "upstream":
+        metrics.observe("upstream_response_bytes", size, size_buckets, endpoint=endpoint)
+    add_timing("upstream", seconds)
+
+def timed_json(operation, function):
+    def timed(value):
+        start = time.perf_counter()
+        result = function(value)
+        seconds = time.perf_counter() - start
+        metrics.observe("json_column_duration_seconds", seconds, operation=operation)
+        add_timing("json", seconds)
+        return result
+    return timed
+
+#upstream base urls, benchmarks/stub_upstream.py stands in for all of them (amadeus uses AMADEUS_BASE_URL and AMADEUS_AUTH_URL)
+api_ninjas_url = os.environ.get("API_NINJAS_URL", "https://api.api-ninjas.com/v1")
+flight_api_url = os.environ.get("FLIGHT_API_URL", "https://api.flightapi.io")
+liteapi_url = os.environ.get("LITEAPI_URL", "https://api.liteapi.travel/v3.0")
+
+#cache for api requests, each endpoint keeps responses for as long as its data stays good (seconds)
+cache_policies = [
+    Policy("city", "GET", api_ninjas_url + "/city", int(os.environ.get("CACHE_TTL_CITY", 30 * 86400))),
+    Policy("airports", "GET", os.environ.get("AMADEUS_BASE_URL", "") + "/reference-data/locations/airports", int(os.environ.get("CACHE_TTL_AIRPORTS", 7 * 86400))),
+    Policy("flights", "GET", flight_api_url + "/", int(os.environ.get("CACHE_TTL_FLIGHTS", 600))),
+    Policy("hotels", "GET", liteapi_url + "/data/hotels", int(os.environ.get("CACHE_TTL_HOTELS", 86400))),
+    Policy("hotel_details", "GET", liteapi_url + "/data/hotel", int(os.environ.get("CACHE_TTL_HOTEL_DETAILS", 7 * 86400))),
+    Policy("hotel_rates", "POST", liteapi_url + "/hotels/rates", int(os.environ.get("CACHE_TTL_HOTEL_RATES", 300)))
+]
+session = CachedHTTP(cache_policies,
+                     memory_bytes=int(os.environ.get("CACHE_MEMORY_MB", 64)) * 1024 * 1024,
+                     shared=shared_tier(os.environ.get("REDIS_URL"), os.environ.get("CACHE_DIR", os.path.join(base_dir, "api_cache")),
+                                        int(os.environ.get("CACHE_DISK_MB", 512)) * 1024 * 1024),
+                     sweep_interval=int(os.environ.get("CACHE_SWEEP_SECONDS", 300)),
+                     observer=observe_upstream)
+
+#with ASYNC_VIEWS the searches that wait on the upstream apis are served by async views,
+#their calls share one pooled httpx client on a background event loop and the same cache tiers.
+#the api helpers take the client to use, with async_session their responses have to be awaited
+serve_async = os.environ.get("ASYNC_VIEWS", "0") == "1"
+if serve_async and (httpx is None or importlib.util.find_spec("asgiref") is None):
+    print("async views need httpx and flask[async] installed, using the sync views instead")
+    serve_async = False
+async_session = AsyncCachedHTTP(session, pool_size=int(os.environ.get("ASYNC_POOL_SIZE", 100)),
+                                timeout=float(os.environ.get("ASYNC_HTTP_TIMEOUT", 30))) if serve_async else None
+
+#limits for fetching hotel details in parallel
+hotel_details_workers = int(os.environ.get("HOTEL_DETAILS_WORKERS", 8))
+hotel_details_timeout = float(os.environ.get("HOTEL_DETAILS_TIMEOUT", 10))
+
+#hotel rates are asked for in chunks of hotel ids that run at the same time,
+#with HOTEL_RATES_EARLY the first page is shown before the slowest chunks are back
+hotel_rates_chunk = int(os.environ.get("HOTEL_RATES_CHUNK", 25))
+hotel_rates_early = os.environ.get("HOTEL_RATES_EARLY", "1") == "1"
+rates_executor = ThreadPoolExecutor(max_workers=int(os.environ.get("HOTEL_RATES_WORKERS", 8)))
+hotel_rate_stats = ChunkStats()
+#latest hotel search of each trip, so an older one finishing late does not overwrite it
+hotel_searches = {}
+hotel_searches_lock = threading.Lock()
+
+#how old hotel details can get before they are refetched in the background
+hotel_catalog_max_age = timedelta(days=int(os.environ.get("HOTEL_CATALOG_MAX_AGE_DAYS", 30)))
+catalog_executor = ThreadPoolExecutor(max_workers=1)
+catalog_refreshing = set()
+catalog_lock = threading.Lock()
+
+#how passwords are hashed, older hashes are upgraded when their user logs in
+passwords = PasswordHasher(method=os.environ.get("PASSWORD_HASH_METHOD", "scrypt"),
+                           salt_length=int(os.environ.get("PASSWORD_SALT_LENGTH", 16)),
+                           workers=int(os.environ.get("PASSWORD_WORKERS", 0)) or None)
+
+#logged in users, so page views do not query the users table every time
+user_cache = SearchCache(ttl=int(os.environ.get("USER_CACHE_SECONDS", 60)), max_entries=int(os.environ.get("USER_CACHE_ENTRIES", 10000)))
+
+#hotel list and details are fetched in the background as soon as a trip's destination is known
+hotel_prefetch = os.environ.get("HOTEL_PREFETCH", "1") == "1"
+hotel_prefetch_details = int(os.environ.get("HOTEL_PREFETCH_DETAILS", 200))
+prefetcher = Prefetcher(max_workers=int(os.environ.get("PREFETCH_WORKERS", 2)),
+                        max_pending=int(os.environ.get("PREFETCH_MAX_PENDING", 32)))
+
+#shared pool for running independent city and airport lookups side by side
+lookup_executor = ThreadPoolExecutor(max_workers=int(os.environ.get("LOOKUP_WORKERS", 16)))
+
+#offline city list so most searches don't need api-ninjas
+gazetteer = Gazetteer.load(os.environ.get("GAZETTEER_PATH", os.path.join(base_dir, "data", "cities.csv")))
+gazetteer_fuzzy = os.environ.get("GAZETTEER_FUZZY", "1") == "1"
+
+#offline airport table, amadeus is only asked when no table airport is close to the city
+#set AIRPORT_SOURCE=amadeus to always use the live endpoint
+airport_index = AirportIndex.load(os.environ.get("AIRPORTS_PATH", os.path.join(base_dir, "data", "airports.csv")))
+airport_source = os.environ.get("AIRPORT_SOURCE", "local")
+airport_radius = float(os.environ.get("AIRPORT_RADIUS_KM", 500))
+#a city further than this from every table airport may have its own airport the table doesn't list (km)
+airport_near_radius = float(os.environ.get("AIRPORT_NEAR_KM", 80))
+
+#how long a trip's hotel rates are kept for choosing a room (seconds)
+hotel_rates_keep = int(os.environ.get("HOTEL_RATES_KEEP_SECONDS", 86400))
+
+#orjson when installed, JSON_CODEC=json keeps the stdlib
+json_codec.configure(os.environ.get("JSON_CODEC", "auto"))
+
+#supplier photos are served as webp thumbnails sized for where they are shown, made once and kept on disk.
+#without Pillow, or with THUMBNAILS=0, pages link the supplier photos directly
+thumbnails_enabled = os.environ.get("THUMBNAILS", "1") == "1"
+if thumbnails_enabled and Image is None:
+    print("Pillow is not installed, linking supplier photos directly")
+    thumbnails_enabled = False
+thumbnail_store = ThumbnailStore(os.environ.get("THUMBNAIL_DIR", os.path.join(base_dir, "thumbnails")),
+                                 int(os.environ.get("THUMBNAIL_CACHE_MB", 1024)) * 1024 * 1024,
+                                 sweep_interval=int(os.environ.get("THUMBNAIL_SWEEP_SECONDS", 600))) if thumbnails_enabled else None
+thumbnail_quality = int(os.environ.get("THUMBNAIL_QUALITY", 80))
+thumbnail_scale = int(os.environ.get("THUMBNAIL_SCALE", 1)) #2 for sharp photos on high density screens
+thumbnail_source_bytes = int(os.environ.get("THUMBNAIL_SOURCE_MB", 20)) * 1024 * 1024
+thumbnail_timeout = float(os.environ.get("THUMBNAIL_TIMEOUT", 10))
+#one download and one encode at a time per photo and slot, concurrent first requests wait for it.
+#nothing is kept in memory (max_entries=0), the results are in thumbnail_store
+thumbnail_loads = SearchCache(max_entries=0, wait_timeout=int(os.environ.get("THUMBNAIL_WAIT_SECONDS", 60)))
+#thumbnail urls are signed, so the proxy cannot be used to fetch anything else.
+#all workers need the same key, a random one only works with a single process
+thumbnail_key = (os.environ.get("THUMBNAIL_KEY") or os.environ.get("FLASK_KEY") or os.urandom(32).hex()).encode()
+
+#results per page and whether pages are streamed to the browser
+tickets_per_page = int(os.environ.get("TICKETS_PER_PAGE", 25))
+hotels_per_page = int(os.environ.get("HOTELS_PER_PAGE", 20))
+stream_templates = os.environ.get("STREAM_TEMPLATES", "0") == "1"
+
+#column tables of recent flight searches for sorting and filtering tickets
+itinerary_tables = TableCache(max_searches=int(os.environ.get("ITINERARY_TABLE_CACHE", 64)))
+#column tables of recent hotel searches, keyed by trip
+hotel_tables = TableCache(max_searches=int(os.environ.get("HOTEL_TABLE_CACHE", 64)))
+
+#rendered hotel and itinerary cards, the parts that are the same for every trip showing them.
+#hotels are keyed by id and catalog fetch time, itineraries by search and id. sizes are in characters
+card_fragments = SearchCache(ttl=int(os.environ.get("FRAGMENT_CACHE_SECONDS", 3600)),
+                             max_bytes=int(os.environ.get("FRAGMENT_CACHE_MB", 32)) * 1024 * 1024,
+                             sizeof=lambda card: sum(len(part) for part in card.values() if isinstance(part, str)))
+
+#processed flight searches shared across users, keyed by route, dates, travelers and cabin
+flight_searches = SearchCache(ttl=int(os.environ.get("FLIGHT_CACHE_TTL", 900)),
+                              max_bytes=int(os.environ.get("FLIGHT_CACHE_MB", 64)) * 1024 * 1024,
+                              sizeof=lambda value: value[1].approx_size(),
+                              wait_timeout=int(os.environ.get("FLIGHT_SEARCH_WAIT_SECONDS", 60)))
+
+#shared amadeus token, refreshed shortly before it expires
+amadeus_tokens = TokenManager(url=os.environ.get("AMADEUS_AUTH_URL", "https://test.api.amadeus.com/v1/security/oauth2/token"),
+                              client_id_env="AMADEUS_API_KEY", client_secret_env="AMADEUS_API_SECRET",
+                              refresh_margin=int(os.environ.get("AMADEUS_TOKEN_MARGIN", 60)))
+#what a token refresh or an amadeus call raises: http and connection errors, or a token answer without a token
+amadeus_errors = (requests.RequestException, KeyError, ValueError)
 
 #set up flask app
 app = Flask(__name__)
@@ -52,7 +227,26 @@ class Base(DeclarativeBase):
 
 #db set up
 app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get("DATABASE_URL")
-db = SQLAlchemy(model_class=Base)
+#json columns go through the same codec as the api responses
+app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+    "json_serializer": timed_json("dump", json_codec.dumps),
+    "json_deserializer": timed_json("load", json_codec.loads)
+}
+#connection pool and compiled statement cache, left to sqlalchemy's defaults unless set
+#(sqlite in memory has no pool size or overflow)
+engine_settings = {
+    "pool_size": ("DB_POOL_SIZE", int),
+    "max_overflow": ("DB_MAX_OVERFLOW", int),
+    "pool_timeout": ("DB_POOL_TIMEOUT", float),
+    "pool_recycle": ("DB_POOL_RECYCLE", int),
+    "pool_pre_ping": ("DB_POOL_PRE_PING", lambda value: value == "1"),
+    "query_cache_size": ("DB_QUERY_CACHE_SIZE", int)
+}
+for option, (name, convert) in engine_settings.items():
+    if os.environ.get(name):
+        app.config["SQLALCHEMY_ENGINE_OPTIONS"][option] = convert(os.environ[name])
+#each request commits once at the end, objects keep their values after it instead of being reloaded
+db = SQLAlchemy(model_class=Base, session_options={"expire_on_commit": False})
 db.init_app(app)
 
 class User(UserMixin, db.Model):
@@ -79,28 +273,154 @@ class Trip(db.Model):
     rooms: Mapped[int] = mapped_column(Integer, nullable=False)
     check_in_date: Mapped[datetime] = mapped_column(DateTime, nullable=True)
     check_out_date: Mapped[datetime] = mapped_column(DateTime, nullable=True)
+    #legacy json copies of the flight search, only read when migrating old trips
     leg_id_list = mapped_column(JSON)
     agent_id_list = mapped_column(JSON)
     segment_id_list = mapped_column(JSON)
     place_id_list = mapped_column(JSON)
     itinerary_id_list = mapped_column(JSON)
     itinerary_id: Mapped[str] = mapped_column(String)
+    search_id: Mapped[int] = mapped_column(Integer, db.ForeignKey("flight_searches.id"), nullable=True)
+    search = relationship("FlightSearch")
     user_id: Mapped[int] = mapped_column(Integer, db.ForeignKey("users.id"))
     user = relationship("User", back_populates="trips")
+    #legacy json copies of the hotel search, only read when migrating old trips
     details_id_list = mapped_column(JSON)
     prices_id_list = mapped_column(JSON)
     hotel_id_list = mapped_column(JSON)
+    #hotel search as references, hotel data lives in the catalog and rates in the api cache
+    hotel_ids = mapped_column(JSON) #priced hotels in search order
+    hotel_prices = mapped_column(JSON) #hotel id -> total price shown on the hotels page
+    hotel_id: Mapped[str] = mapped_column(String(50), nullable=True)
+    room_id: Mapped[str] = mapped_column(String(50), nullable=True)
+    offer_id: Mapped[str] = mapped_column(String, nullable=True)
+
+#one flightapi search, shared by every trip that picked from it
+class FlightSearch(db.Model):
+    __tablename__ = "flight_searches"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    origin: Mapped[str] = mapped_column(String(10), nullable=False)
+    destination: Mapped[str] = mapped_column(String(10), nullable=False)
+    start_date: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+    end_date: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+    travelers: Mapped[int] = mapped_column(Integer, nullable=False)
+    cabin_class: Mapped[str] = mapped_column(String(50), nullable=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=datetime.now)
+
+#itineraries, legs and segments are keyed by (search_id, flightapi id) so one can be loaded by primary key
+class Itinerary(db.Model):
+    __tablename__ = "itineraries"
+    search_id: Mapped[int] = mapped_column(Integer, db.ForeignKey("flight_searches.id"), primary_key=True)
+    id: Mapped[str] = mapped_column(String, primary_key=True)
+    position: Mapped[int] = mapped_column(Integer, nullable=False) #order flightapi returned it in
+    leg_ids = mapped_column(JSON, nullable=False)
+    price: Mapped[float] = mapped_column(Float, nullable=False) #total for all travelers
+    agent: Mapped[str] = mapped_column(String(200), nullable=False)
+    url: Mapped[str] = mapped_column(String, nullable=False)
+
+class Leg(db.Model):
+    __tablename__ = "legs"
+    search_id: Mapped[int] = mapped_column(Integer, db.ForeignKey("flight_searches.id"), primary_key=True)
+    id: Mapped[str] = mapped_column(String, primary_key=True)
+    departure: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+    arrival: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+    duration: Mapped[int] = mapped_column(Integer, nullable=False)
+    stop_count: Mapped[int] = mapped_column(Integer, nullable=False)
+    segment_ids = mapped_column(JSON, nullable=False)
+
+class Segment(db.Model):
+    __tablename__ = "segments"
+    search_id: Mapped[int] = mapped_column(Integer, db.ForeignKey("flight_searches.id"), primary_key=True)
+    id: Mapped[str] = mapped_column(String, primary_key=True)
+    departure: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+    arrival: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+    origin_code: Mapped[str] = mapped_column(String(10), nullable=False)
+    destination_code: Mapped[str] = mapped_column(String(10), nullable=False)
+
+#static hotel data from liteapi's /data/hotel, kept across searches and refreshed when old
+class HotelCatalog(db.Model):
+    __tablename__ = "hotel_catalog"
+    id: Mapped[str] = mapped_column(String(50), primary_key=True) #liteapi hotelId
+    details = mapped_column(JSON, nullable=False)
+    summary = mapped_column(JSON) #the hotel's entry in the /data/hotels list
+    fetched_at: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+
+#columns added after the first release, create_all does not add columns to existing tables
+added_columns = {
+    "trips": {
+        "search_id": "INTEGER REFERENCES flight_searches(id)",
+        "hotel_ids": "JSON",
+        "hotel_prices": "JSON",
+        "hotel_id": "VARCHAR(50)",
+        "room_id": "VARCHAR(50)",
+        "offer_id": "VARCHAR"
+    },
+    "hotel_catalog": {"summary": "JSON"}
+}
+
+def upgrade_schema():
+    inspector = inspect(db.engine)
+    for table, columns in added_columns.items():
+        existing = [column["name"] for column in inspector.get_columns(table)]
+        for column, definition in columns.items():
+            if column not in existing:
+                with db.engine.begin() as connection:
+                    connection.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {definition}"))
+
+#commits and statements are timed through sqlalchemy's events
+@event.listens_for(db.session, "before_commit")
+def start_commit(session):
+    #savepoints are part of the commit that follows them
+    if not session.in_nested_transaction():
+        session.info["commit_start"] = time.perf_counter()
+
+@event.listens_for(db.session, "after_commit")
+def record_commit(session):
+    start = session.info.pop("commit_start", None)
+    if start is not None:
+        seconds = time.perf_counter() - start
+        metrics.observe("db_commit_duration_seconds", seconds)
+        add_timing("commit", seconds)
+        if has_request_context():
+            g.commits = g.get("commits", 0) + 1
+
+def start_query(connection, cursor, statement, parameters, context, executemany):
+    connection.info.setdefault("query_start", []).append(time.perf_counter())
+
+def record_query(connection, cursor, statement, parameters, context, executemany):
+    seconds = time.perf_counter() - connection.info["query_start"].pop()
+    metrics.observe("db_query_duration_seconds", seconds)
+    add_timing("db", seconds)
 
 with app.app_context():
+    event.listen(db.engine, "before_cursor_execute", start_query)
+    event.listen(db.engine, "after_cursor_execute", record_query)
     db.create_all()
+    upgrade_schema()
 
 #user authentication
 login_manager = LoginManager()
 login_manager.init_app(app)
 
+#users are kept as their column values for a short time, so an authenticated page view
+#attaches a copy to the session instead of querying for the user again
+def user_values(user):
+    return {column.key: getattr(user, column.key) for column in User.__table__.columns}
+
 @login_manager.user_loader
 def load_user(user_id):
-    return db.get_or_404(User, user_id)
+    values = user_cache.get(int(user_id))
+    if values is None:
+        user = db.get_or_404(User, user_id)
+        user_cache.put(user.id, user_values(user))
+        return user
+    user = User(**values)
+    make_transient_to_detached(user)
+    return db.session.merge(user, load=False)
+
+#call after changing or removing a user so no page sees the old values
+def forget_user(user_id):
+    user_cache.discard(int(user_id))
 
 #format time for itinerary
 @app.template_filter("format_time")
@@ -124,6 +444,144 @@ def format_date(value):
         return ""
     return dt.strftime("%m/%d/%Y")
 
+#url of a supplier photo's thumbnail for one of the slots in thumbnails.py
+@app.template_filter("thumb")
+def thumb(url, slot):
+    if thumbnail_store is None or not url:
+        return url
+    return url_for("thumbnail", slot=slot, signature=sign(thumbnail_key, url, slot), url=url)
+
+#page numbers for a list of results, with links to the pages around it
+def paginate(total, page, per_page, endpoint, **args):
+    pages = max((total + per_page - 1) // per_page, 1)
+    page = min(max(page or 1, 1), pages)
+    return {
+        "page": page,
+        "pages": pages,
+        "total": total,
+        "offset": (page - 1) * per_page,
+        "limit": per_page,
+        "prev_url": url_for(endpoint, page=page - 1, **args) if page > 1 else None,
+        "next_url": url_for(endpoint, page=page + 1, **args) if page < pages else None
+    }
+
+#render a template, or stream it so the first results reach the browser while the rest is formatted
+def render_page(template, **context):
+    if stream_templates or request.args.get("stream") == "1":
+        return stream_template(template, **context)
+    return render_template(template, **context)
+
+#every route is timed from the first before_request hook to the response leaving the view,
+#a streamed page's body is still being rendered after this
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request(response):
+    start = g.get("request_start")
+    if start is None:
+        return response
+    seconds = time.perf_counter() - start
+    endpoint = request.endpoint or "unmatched"
+    metrics.observe("http_request_duration_seconds", seconds, endpoint=endpoint, method=request.method, status=response.status_code)
+    timings = g.get("timings", {})
+    metrics.observe("db_request_seconds", timings.get("db", 0.0) + timings.get("commit", 0.0), endpoint=endpoint)
+    metrics.observe("db_commits_per_request", g.get("commits", 0), commit_buckets, endpoint=endpoint)
+    if server_timing:
+        phases = [f"{phase};dur={phase_seconds * 1000:.1f}" for phase, phase_seconds in timings.items()]
+        response.headers["Server-Timing"] = ", ".join(phases + [f"total;dur={seconds * 1000:.1f}"])
+    return response
+
+@before_render_template.connect_via(app)
+def start_render(sender, template, context, **extra):
+    g.setdefault("render_starts", []).append(time.perf_counter())
+
+@template_rendered.connect_via(app)
+def record_render(sender, template, context, **extra):
+    starts = g.get("render_starts")
+    if starts:
+        seconds = time.perf_counter() - starts.pop()
+        metrics.observe("template_render_duration_seconds", seconds, template=template.name)
+        add_timing("render", seconds)
+
+#counters the caches and pools keep themselves, read when /metrics is
+metrics.collect("api_cache", session.all_stats, label="endpoint",
+                counters=("memory_hits", "shared_hits", "misses", "upstream_calls", "bytes"))
+metrics.collect("flight_search_cache", flight_searches.stats, counters=("hits", "misses", "waits"))
+metrics.collect("user_cache", user_cache.stats, counters=("hits", "misses", "waits"))
+metrics.collect("card_fragments", card_fragments.stats, counters=("hits", "misses", "waits"))
+metrics.collect("hotel_rate_chunks", hotel_rate_stats.stats, counters=("chunks", "failures", "hotels"))
+metrics.collect("prefetch", prefetcher.stats, counters=("submitted", "dropped", "cancelled", "failed"))
+metrics.collect("amadeus_token", amadeus_tokens.stats, counters=("hits", "refreshes", "waits"))
+
+@app.route("/metrics")
+def show_metrics():
+    if metrics_token and request.headers.get("Authorization") != f"Bearer {metrics_token}":
+        abort(403)
+    return metrics.render(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
+#thumbnails never change for a url and slot, browsers keep them for a year and revalidate with the etag
+@app.route("/thumb/<slot>/<signature>")
+def thumbnail(slot, signature):
+    url = request.args.get("url", "")
+    if thumbnail_store is None or slot not in slots or not verify(thumbnail_key, url, slot, signature):
+        abort(404)
+    name = f"{slot}\n{url}"
+    stored = thumbnail_store.get(name)
+    if stored is None:
+        try:
+            stored = thumbnail_loads.get_or_load(name, lambda: make_slot_thumbnail(url, slot, name))
+        except TimeoutError:
+            print(f"thumbnail for {url} is taking too long")
+            stored = None
+        if stored is None:
+            return redirect(url)
+    else:
+        metrics.inc("thumbnail_requests_total", result="hit")
+    digest, path = stored
+    response = send_file(path, mimetype="image/webp", etag=digest, max_age=365 * 86400, conditional=True)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+#content hash and path of a new thumbnail, None when the photo can't be fetched or read
+def make_slot_thumbnail(url, slot, name):
+    #a request that held the load before this one may have just stored it
+    stored = thumbnail_store.get(name)
+    if stored is not None:
+        return stored
+    with metrics.timer("thumbnail_duration_seconds"):
+        content = source_photo(url)
+        if content is None:
+            metrics.inc("thumbnail_requests_total", result="error")
+            return None
+        width, height = slots[slot]
+        try:
+            image = make_thumbnail(content, width * thumbnail_scale, height * thumbnail_scale if height else None, thumbnail_quality)
+        except Exception as error:
+            print(f"thumbnail failed for {url}: {error}")
+            metrics.inc("thumbnail_requests_total", result="error")
+            return None
+        stored = thumbnail_store.put(name, image)
+    metrics.inc("thumbnail_requests_total", result="made")
+    return stored
+
+#the supplier's photo, downloaded once for all of its slots
+def source_photo(url):
+    name = f"source\n{url}"
+    stored = thumbnail_store.get(name)
+    if stored is not None:
+        with open(stored[1], "rb") as file:
+            return file.read()
+    return thumbnail_loads.get_or_load(name, lambda: fetch_source_photo(url, name))
+
+def fetch_source_photo(url, name):
+    content = fetch_image(session.session, url, thumbnail_source_bytes, thumbnail_timeout)
+    if content is not None:
+        thumbnail_store.put(name, content)
+    return content
+
 #home page
 @app.route("/")
 def home():
@@ -134,378 +592,587 @@ def home():
 @app.route("/register", methods=["GET", "POST"])
 def register():
     if request.method == "POST":
-        email = request.form.get("email")
-        password = request.form.get("password")
-        username = request.form.get("username")
-        #get the user in the data base to check if there is already a user
-        user = db.session.execute(db.select(User).where(User.email == email))
-        user = user.scalar()
-        if user:
-            flash("Email is already in use")
-            return redirect(url_for("register"))
-        #check username
-        user = db.session.execute(db.select(User).where(User.username == username))
-        user = user.scalar()
-        if user:
-            flash("Username is already in use")
-            return redirect(url_for("register"))
-        
-        #once validated, make new user object and put in database
-        new_user = User(email=email,
-                        password=generate_password_hash(password, method="pbkdf2:sha256", salt_length=8),
-                        username=username)
-        
-        db.session.add(new_user)
-        db.session.commit()
-        login_user(new_user)
-        return redirect(url_for("home"))
-    
+        return add_user(request.form, passwords.hash(request.form.get("password")))
+    return render_template("register.html", logged_in=current_user.is_authenticated)
+
+async def register_async():
+    if request.method == "POST":
+        return add_user(request.form, await passwords.hash_async(request.form.get("password")))
     return render_template("register.html", logged_in=current_user.is_authenticated)
 
+def add_user(form, password_hash):
+    email = form.get("email")
+    username = form.get("username")
+
+    #make new user object and put in database, the unique columns reject taken emails and usernames
+    new_user = User(email=email,
+                    password=password_hash,
+                    username=username)
+
+    db.session.add(new_user)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        #only a failed insert needs the query to tell which one is taken
+        taken = db.session.execute(db.select(User.id).where(User.email == email)).first()
+        flash("Email is already in use" if taken else "Username is already in use")
+        return redirect(url_for("register"))
+    login_user(new_user)
+    return redirect(url_for("home"))
+
 #login user with validation
 @app.route("/login", methods=["GET", "POST"])
 def login():
     if request.method == "POST":
-        username = request.form.get("username")
         password = request.form.get("password")
-        #validate user login
-        user = db.session.execute(db.select(User).where(User.username == username))
-        user = user.scalar()
+        user = find_login_user(request.form.get("username"))
         if not user:
-            user = db.session.execute(db.select(User).where(User.email == username))
-            user = user.scalar()
-            if not user:
-                flash("Wrong username or email")
-                return redirect(url_for('login'))
-            
-        if not check_password_hash(user.password, password):
+            flash("Wrong username or email")
+            return redirect(url_for('login'))
+
+        if not passwords.verify(user.password, password):
             flash("Wrong password")
             return redirect(url_for('login'))
+        if passwords.needs_rehash(user.password):
+            upgrade_password(user, passwords.hash(password))
         #for user auth
         login_user(user)
         return redirect(url_for('home'))
     
     return render_template("login.html", logged_in=current_user.is_authenticated)
 
+async def login_async():
+    if request.method == "POST":
+        password = request.form.get("password")
+        user = find_login_user(request.form.get("username"))
+        if not user:
+            flash("Wrong username or email")
+            return redirect(url_for('login'))
+
+        if not await passwords.verify_async(user.password, password):
+            flash("Wrong password")
+            return redirect(url_for('login'))
+        if passwords.needs_rehash(user.password):
+            upgrade_password(user, await passwords.hash_async(password))
+        login_user(user)
+        return redirect(url_for('home'))
+
+    return render_template("login.html", logged_in=current_user.is_authenticated)
+
+#validate user login, one query for the username or the email
+#and a username match wins if both match different users
+def find_login_user(username):
+    user = db.session.execute(db.select(User).where(or_(User.username == username, User.email == username))
+                              .order_by(case((User.username == username, 0), else_=1)).limit(1))
+    return user.scalar()
+
+def upgrade_password(user, password_hash):
+    user.password = password_hash
+    db.session.commit()
+    forget_user(user.id)
+
 
 @app.route("/logout")
 def logout():
+    if current_user.is_authenticated:
+        forget_user(current_user.id)
     logout_user()
     return redirect(url_for('home'))
 
+#find the city in the local gazetteer first, only ask api-ninjas when it is not there
+def find_city(name):
+    city = gazetteer.lookup(name, fuzzy=gazetteer_fuzzy)
+    if city is not None:
+        return city
+    city = get_city(destination=name)
+    return city.json()
+
+async def find_city_async(name):
+    city = gazetteer.lookup(name, fuzzy=gazetteer_fuzzy)
+    if city is not None:
+        return city
+    city = await get_city(destination=name, client=async_session)
+    return city.json()
+
 #use api to get the iata code of the city
-def get_city(destination):
-    url = "https://api.api-ninjas.com/v1/city"
+def get_city(destination, client=session):
+    url = api_ninjas_url + "/city"
     headers = {
         "X-Api-Key": os.environ.get("API_NINJAS_KEY")
     }
     params = {
         "name": destination
     }
-    response = session.get(url, params=params, headers=headers)
+    response = client.get(url, params=params, headers=headers)
     return response
 
 #use iata code to search for airports
-def get_airports(longitude, latitude):
+def get_airports(longitude, latitude, token=None, client=session):
     url = os.environ.get("AMADEUS_BASE_URL") + "/reference-data/locations/airports"
+    if token is None:
+        token = amadeus_tokens.get()
     headers = {
-        "Authorization": f"Bearer {os.environ.get("AMADEUS_ACCESS_TOKEN")}"
+        "Authorization": f"Bearer {token}"
     }
     params = {
         "latitude": latitude,
         "longitude": longitude,
         "page[limit]": 5
     }
-    response = session.get(url, params=params, headers=headers)
+    response = client.get(url, params=params, headers=headers)
     return response
-    
 
-@app.route("/find-airport", methods=["GET", "POST"])
-def find_airport():
-    if request.method == "POST":
-        #check if the user is not logged in
-        if current_user.is_anonymous:
-            flash("Please login or signup before searching")
-            return redirect(url_for("login"))
-        #validate start and end dates
-        start_date = request.form.get("start_date")
-        end_date = request.form.get("end_date")
-        
-        format = "%Y-%m-%d"
-        start_date = datetime.strptime(start_date, format)
-        end_date = datetime.strptime(end_date, format)
-
-        if end_date <= start_date:
-            flash("End date cannot be before start date")
-            return redirect(url_for("home"))
-        
-        #validates the city inputted by the user, while gathering its location
-        arrival = request.form.get("arrival")
-        destination = request.form.get("destination")
+#find airports near a location, from the local table first and then from amadeus
+#if the amadeus token has expired it is refreshed once and the airport search is retried
+def find_airports(longitude, latitude):
+    nearby, close = local_airports(longitude, latitude)
+    if close:
+        return {"data": nearby}
 
-        #use fuction api to get the actual city
-        destination_city = get_city(destination=destination)
-        destination_city = destination_city.json()
+    try:
+        token = amadeus_tokens.get()
+        airports = get_airports(longitude=longitude, latitude=latitude, token=token)
 
-        if len(destination_city) < 1:
-            flash("Destination city does not exist")
-            return redirect(url_for("home"))
-        #get city
-        arrival_city = get_city(destination=arrival)
-        arrival_city = arrival_city.json()
+        if airports.status_code != 200:
+            print("error")
+            token = amadeus_tokens.refresh(stale=token)
+            airports = get_airports(longitude=longitude, latitude=latitude, token=token)
+    except amadeus_errors as error:
+        if not nearby:
+            raise
+        print(f"amadeus airport search failed, using the table airports: {error}")
+        return {"data": nearby}
+
+    return amadeus_or_local(airports, nearby)
+
+#the token manager blocks on its lock and on the oauth call, it runs off the event loop
+async def find_airports_async(longitude, latitude):
+    nearby, close = local_airports(longitude, latitude)
+    if close:
+        return {"data": nearby}
 
-        if len(arrival_city) < 1:
-            flash("Arrival city does not exist")
-            return redirect(url_for("home"))
-        
-        #find destination airports
-        destination_longitude = destination_city[0]["longitude"]
-        destination_latitude = destination_city[0]["latitude"]
-        
-        #fetch airports and check if airport exists
-        destination_airports = get_airports(longitude=destination_longitude, latitude=destination_latitude)
-
-        if destination_airports.status_code != 200:
+    try:
+        token = await asyncio.to_thread(amadeus_tokens.get)
+        airports = await get_airports(longitude=longitude, latitude=latitude, token=token, client=async_session)
+
+        if airports.status_code != 200:
             print("error")
-            get_token()
-            
-            destination_airports = get_airports(longitude=destination_longitude, latitude=destination_latitude)
-            destination_airports = destination_airports.json()
-        else: 
-            destination_airports = destination_airports.json()
+            token = await asyncio.to_thread(amadeus_tokens.refresh, stale=token)
+            airports = await get_airports(longitude=longitude, latitude=latitude, token=token, client=async_session)
+    except amadeus_errors as error:
+        if not nearby:
+            raise
+        print(f"amadeus airport search failed, using the table airports: {error}")
+        return {"data": nearby}
+
+    return amadeus_or_local(airports, nearby)
+
+#airports from the local table within airport_radius km, and whether the closest one is near enough
+#to use the list without asking amadeus. the table only has the bigger airports, so a city away from
+#all of them (Asheville, Cork) is looked up in amadeus to find its own airport
+def local_airports(longitude, latitude):
+    if airport_source != "local":
+        return [], False
+    airports = airport_index.nearest(latitude=latitude, longitude=longitude, limit=5, radius=airport_radius)
+    return airports, len(airports) > 0 and airports[0]["distance"]["value"] <= airport_near_radius
+
+#the amadeus answer, or the further away table airports when amadeus found nothing
+def amadeus_or_local(response, nearby):
+    if nearby and (response.status_code != 200 or not response.json().get("data")):
+        return {"data": nearby}
+    return response.json()
+
+#find a city and the airports near it, the city and airport lists are returned as json
+def resolve_location(city_name):
+    city = find_city(city_name)
+    if len(city) < 1:
+        return city, None
+
+    airports = find_airports(longitude=city[0]["longitude"], latitude=city[0]["latitude"])
+    return city, airports
+
+async def resolve_location_async(city_name):
+    city = await find_city_async(city_name)
+    if len(city) < 1:
+        return city, None
+
+    airports = await find_airports_async(longitude=city[0]["longitude"], latitude=city[0]["latitude"])
+    return city, airports
+
+
+#dates and cities from the home page search form, or a redirect back with a message
+def read_search_form(form):
+    #check if the user is not logged in
+    if current_user.is_anonymous:
+        flash("Please login or signup before searching")
+        return redirect(url_for("login")), None
+    #validate start and end dates
+    start_date = form.get("start_date")
+    end_date = form.get("end_date")
 
-        if len(destination_airports["data"]) < 1:
-            flash("No airports found from destination city")
-            return redirect(url_for("home"))
+    format = "%Y-%m-%d"
+    start_date = datetime.strptime(start_date, format)
+    end_date = datetime.strptime(end_date, format)
 
-        #arrival airports
-        arrival_longitude = arrival_city[0]["longitude"]
-        arrival_latitude = arrival_city[0]["latitude"]
+    if end_date <= start_date:
+        flash("End date cannot be before start date")
+        return redirect(url_for("home")), None
 
-        arrival_airports = get_airports(longitude=arrival_longitude, latitude=arrival_latitude)
+    #validates the city inputted by the user, while gathering its location
+    return None, (start_date, end_date, form.get("arrival"), form.get("destination"))
 
-        if arrival_airports.status_code != 200:
-            print("error")
-            get_token()
-        
-            arrival_airports = get_airports(longitude=arrival_longitude, latitude=arrival_latitude)
-            arrival_airports = arrival_airports.json()
-        else:
-            arrival_airports = arrival_airports.json()
+#check what was found for both cities, then save the trip and show the airports to pick from
+def create_trip(start_date, end_date, destination_lookup, arrival_lookup):
+    destination_city, destination_airports = destination_lookup
+    arrival_city, arrival_airports = arrival_lookup
 
-        if len(arrival_airports["data"]) < 1:
-            flash("No airports found from arrival city")
-            return redirect(url_for("home"))
-        
-        travelers = request.form.get("travelers")
-        #create new trip object
-        new_trip = Trip(start_date=start_date, end_date=end_date, travelers=travelers, cabin_class="", 
-                        rooms=0, arrival="", destination="", user=current_user, arrival_lat=arrival_latitude, 
-                        arrival_lon=arrival_longitude,destination_lon=destination_longitude, 
-                        destination_lat=destination_latitude, itinerary_id="")
-        db.session.add(new_trip)
-        db.session.commit()
-        trip_id = new_trip.id #pass the id to the next page
-        
-        return render_template("search.html", arrival=arrival_airports["data"], destination=destination_airports["data"], logged_in=current_user.is_authenticated, trip_id=trip_id)
+    if len(destination_city) < 1:
+        flash("Destination city does not exist")
+        return redirect(url_for("home"))
+
+    if len(arrival_city) < 1:
+        flash("Arrival city does not exist")
+        return redirect(url_for("home"))
+    
+    destination_longitude = destination_city[0]["longitude"]
+    destination_latitude = destination_city[0]["latitude"]
+
+    if len(destination_airports["data"]) < 1:
+        flash("No airports found from destination city")
+        return redirect(url_for("home"))
+
+    arrival_longitude = arrival_city[0]["longitude"]
+    arrival_latitude = arrival_city[0]["latitude"]
+
+    if len(arrival_airports["data"]) < 1:
+        flash("No airports found from arrival city")
+        return redirect(url_for("home"))
+    
+    travelers = request.form.get("travelers")
+    #create new trip object
+    new_trip = Trip(start_date=start_date, end_date=end_date, travelers=travelers, cabin_class="", 
+                    rooms=0, arrival="", destination="", user=current_user, arrival_lat=arrival_latitude, 
+                    arrival_lon=arrival_longitude,destination_lon=destination_longitude, 
+                    destination_lat=destination_latitude, itinerary_id="")
+    db.session.add(new_trip)
+    db.session.commit()
+    trip_id = new_trip.id #pass the id to the next page
+
+    if hotel_prefetch:
+        #only the newest trip of a user is worth prefetching for
+        prefetcher.submit(trip_id, prefetch_hotels, destination_latitude, destination_longitude, group=current_user.id)
     
+    return render_template("search.html", arrival=arrival_airports["data"], destination=destination_airports["data"], logged_in=current_user.is_authenticated, trip_id=trip_id)
+
+def search_redirect():
     if current_user.is_anonymous:
         flash("Please login or signup before searching")
         return redirect(url_for("login"))
     
     return redirect(url_for("home"))
 
-@app.route("/find-tickets", methods=["POST", "GET"])
-def find_tickets():
+@app.route("/find-airport", methods=["GET", "POST"])
+def find_airport():
+    if request.method == "POST":
+        error, search = read_search_form(request.form)
+        if error is not None:
+            return error
+        start_date, end_date, arrival, destination = search
+
+        #look up both cities and their airports at the same time
+        destination_lookup = lookup_executor.submit(resolve_location, destination)
+        arrival_lookup = lookup_executor.submit(resolve_location, arrival)
+        return create_trip(start_date, end_date, destination_lookup.result(), arrival_lookup.result())
+    return search_redirect()
+
+async def find_airport_async():
     if request.method == "POST":
-        #get form variables
-        arrival_airport = request.form.get("arrival")
-        destination_airport = request.form.get("destination")
-        cabin_class = request.form.get("cabin_class")
-        trip_id = request.form.get('id')
-
-        #find trip in the database 
-        trip = db.session.execute(db.select(Trip).where(Trip.id == trip_id))
-        trip = trip.scalar()
-        #update values
-        trip.arrival = arrival_airport
-        trip.destination = destination_airport
-        trip.cabin_class = cabin_class
-
-        #fix the date bug, format the dates 
-        format = "%Y-%m-%d"
-        start_date = trip.start_date.strftime(format)
-        end_date = trip.end_date.strftime(format)
+        error, search = read_search_form(request.form)
+        if error is not None:
+            return error
+        start_date, end_date, arrival, destination = search
+
+        destination_lookup, arrival_lookup = await asyncio.gather(resolve_location_async(destination), resolve_location_async(arrival))
+        return create_trip(start_date, end_date, destination_lookup, arrival_lookup)
+    return search_redirect()
+
+#store a parsed flightapi response in the search tables and point the trip at it
+def save_flight_search(trip, parsed):
+    search = FlightSearch(origin=trip.arrival, destination=trip.destination, start_date=trip.start_date,
+                          end_date=trip.end_date, travelers=trip.travelers, cabin_class=trip.cabin_class)
+    db.session.add(search)
+    db.session.flush() #to get the search id
+
+    segments = [{"search_id": search.id, "id": segment.id, "departure": segment.departure, "arrival": segment.arrival,
+                 "origin_code": segment.origin_code, "destination_code": segment.destination_code}
+                for segment in parsed.segments.values()]
+    legs = [{"search_id": search.id, "id": leg.id, "departure": leg.departure, "arrival": leg.arrival,
+             "duration": leg.duration, "stop_count": leg.stop_count, "segment_ids": leg.segment_ids}
+            for leg in parsed.legs.values()]
+    itineraries = [{"search_id": search.id, "id": itinerary.id, "position": itinerary.position, "leg_ids": itinerary.leg_ids,
+                    "price": itinerary.price, "agent": itinerary.agent, "url": itinerary.url}
+                   for itinerary in parsed.itineraries]
+
+    #bulk inserts, one statement per table
+    for model, rows in ((Segment, segments), (Leg, legs), (Itinerary, itineraries)):
+        if len(rows) > 0:
+            db.session.execute(insert(model), rows)
+
+    trip.search = search
+    return search
+
+#load the itinerary a trip picked, with its legs in order and the segments they use
+def load_itinerary(trip):
+    itinerary = db.session.get(Itinerary, (trip.search_id, trip.itinerary_id))
+    legs = db.session.execute(db.select(Leg).where(Leg.search_id == trip.search_id, Leg.id.in_(itinerary.leg_ids)))
+    legs = {leg.id: leg for leg in legs.scalars()}
+    legs = [legs[leg_id] for leg_id in itinerary.leg_ids]
+
+    segment_ids = [segment_id for leg in legs for segment_id in leg.segment_ids]
+    segments = db.session.execute(db.select(Segment).where(Segment.search_id == trip.search_id, Segment.id.in_(segment_ids)))
+    segments = {segment.id: segment for segment in segments.scalars()}
+    return itinerary, legs, segments
+
+#move the json copies kept on trips from before the search tables into them
+def import_legacy_search(trip):
+    if trip.search_id is not None or not trip.itinerary_id_list:
+        return None
+    options = {
+        "legs": list(trip.leg_id_list.values()),
+        "agents": list(trip.agent_id_list.values()),
+        "segments": list(trip.segment_id_list.values()),
+        "places": list(trip.place_id_list.values()),
+        "itineraries": list(trip.itinerary_id_list.values())
+    }
+    search = save_flight_search(trip, parse_response(options, base_url=base_url))
+    trip.leg_id_list = None
+    trip.agent_id_list = None
+    trip.segment_id_list = None
+    trip.place_id_list = None
+    trip.itinerary_id_list = None
+    return search
+
+#move the hotel lists, prices and details kept on old trips into the catalog and keep references
+def slim_legacy_hotels(trip):
+    if not trip.prices_id_list:
+        return False
+    details_id_list = trip.details_id_list or {}
+    hotel_id_list = trip.hotel_id_list or {}
+    stored = store_catalog(details_id_list)
+    store_catalog_summaries({id: hotel_id_list[id] for id in stored if id in hotel_id_list})
+
+    trip.hotel_ids = [id for id in trip.prices_id_list if id in stored and id in hotel_id_list]
+    trip.hotel_prices = {id: cheapest_rate(trip.prices_id_list[id]) for id in trip.hotel_ids}
+    trip.details_id_list = None
+    trip.hotel_id_list = None
+    trip.prices_id_list = None
+    return True
+
+#size of a trip's json columns, to report how much the migration saved
+def trip_json_size(trip):
+    columns = ("leg_id_list", "agent_id_list", "segment_id_list", "place_id_list", "itinerary_id_list",
+               "details_id_list", "prices_id_list", "hotel_id_list", "hotel_ids", "hotel_prices")
+    return sum(len(json.dumps(getattr(trip, column))) for column in columns if getattr(trip, column) is not None)
+
+@app.cli.command("migrate-trips")
+def migrate_trips():
+    trips = db.session.execute(db.select(Trip)).scalars().all()
+    searches = 0
+    hotels = 0
+    before = 0
+    after = 0
+    for trip in trips:
+        before += trip_json_size(trip)
+        #the catalog is written on its own connection, so do it before this trip's session writes
+        if slim_legacy_hotels(trip):
+            hotels += 1
+        if import_legacy_search(trip) is not None:
+            searches += 1
+        after += trip_json_size(trip)
+        db.session.commit()
+    print(f"moved {searches} trips to the search tables and {hotels} trips to the hotel catalog")
+    print(f"json on trip rows went from {before / 1024:.1f} KB to {after / 1024:.1f} KB")
+
+#a flight search that could not be turned into itineraries, the message is shown to the user
+class FlightSearchError(Exception):
+    pass
+
+#ask flightapi for a trip's flights, save them and build the column table for the tickets page
+def search_flights(trip, start_date, end_date):
+    tickets = session.get(flight_search_url(trip, start_date, end_date))
+    return save_flight_options(trip, tickets.json())
+
+async def search_flights_async(trip, start_date, end_date):
+    tickets = await async_session.get(flight_search_url(trip, start_date, end_date))
+    return save_flight_options(trip, tickets.json())
+
+#url to search for flight prices
+def flight_search_url(trip, start_date, end_date):
+    return f"{flight_api_url}/roundtrip/{os.environ.get('FLIGHT_API_KEY')}/{trip.arrival}/{trip.destination}/{start_date}/{end_date}/{trip.travelers}/0/0/{trip.cabin_class}/USD"
+
+def save_flight_options(trip, options):
+    #check if there is flights, else send user back to home page
+    if "itineraries" not in options:
+        print(options)
+        raise FlightSearchError("API key error")
+
+    if len(options["itineraries"]) < 1:
+        raise FlightSearchError("No flights found")
+    
+    # filename = 'tickets.json'
+    # with open(filename, "w") as json_file:
+    #     json.dump(options, json_file, indent=4)
+    # print(options)
     
+    #parse the response once, then format every itinerary for the html page
+    try:
+        parsed, itinerary_list = flatten_response(options, travelers=trip.travelers, base_url=base_url)
+    except ItineraryError as error:
+        print(error)
+        raise FlightSearchError("Server error")
+
+    #save the search in its own tables so later pages can load one itinerary by key,
+    #it is committed before other requests are handed its id
+    search = save_flight_search(trip, parsed)
+    db.session.commit()
+    table = itinerary_tables.put(search.id, ItineraryTable(itinerary_list))
+    return search.id, table
+
+#point the trip at the airports and cabin picked, returns the trip, the shared search key and the dates
+def start_flight_search(form):
+    #get form variables
+    arrival_airport = form.get("arrival")
+    destination_airport = form.get("destination")
+    cabin_class = form.get("cabin_class")
+    trip_id = form.get('id')
+
+    #find trip in the database 
+    trip = db.session.execute(db.select(Trip).where(Trip.id == trip_id))
+    trip = trip.scalar()
+    #update values
+    trip.arrival = arrival_airport
+    trip.destination = destination_airport
+    trip.cabin_class = cabin_class
+
+    #fix the date bug, format the dates 
+    format = "%Y-%m-%d"
+    start_date = trip.start_date.strftime(format)
+    end_date = trip.end_date.strftime(format)
+
+    #identical searches from any user share one flightapi call and one processed result
+    key = (arrival_airport, destination_airport, start_date, end_date, trip.travelers, trip.cabin_class)
+    return trip, key, start_date, end_date
+
+#a new search was committed together with the trip that asked for it,
+#a search from the cache or another user's request still has to be saved on the trip
+def show_flight_search(trip, search_id, table):
+    if trip.search_id != search_id:
+        trip.search_id = search_id
         db.session.commit()
-        #url to search for flight prices
-        url = f"https://api.flightapi.io/roundtrip/{os.environ.get('FLIGHT_API_KEY')}/{arrival_airport}/{destination_airport}/{start_date}/{end_date}/{trip.travelers}/0/0/{trip.cabin_class}/USD"
-        # print(url)
-        tickets = session.get(url)
-        #check if there is flights, else send user back to home page
-        options = tickets.json()
+    return render_tickets(trip, table)
+
+@app.route("/find-tickets", methods=["POST", "GET"])
+def find_tickets():
+    if request.method == "POST":
+        trip, key, start_date, end_date = start_flight_search(request.form)
         try:
-            itineraries = options["itineraries"]
-        except:
-            flash("API key error")
-            print(options)
+            search_id, table = flight_searches.get_or_load(key, lambda: search_flights(trip, start_date, end_date))
+        except FlightSearchError as error:
+            flash(str(error))
             return redirect(url_for("home"))
-
-        if len(options) < 1:
-            flash("No flights found")
+        except TimeoutError:
+            #the same search from another user is still running
+            flash("The flight search is taking too long, please try again")
             return redirect(url_for("home"))
-        
-        # filename = 'tickets.json'
-        # with open(filename, "w") as json_file:
-        #     json.dump(options, json_file, indent=4)
-        # print(options)
-        
-        #format prep to display
-        itinerary_list = []
-        leg_id_list = {}
-        agent_id_list = {}
-        segment_id_list = {}
-        place_id_list = {}
-        itinerary_id_list = {}
-
-        #make hash tables for different sections that need to be accessed to reduce time
-        for leg in options["legs"]:
-            leg_id_list[leg["id"]] = leg
-
-        for agent in options["agents"]:
-            agent_id_list[agent["id"]] = agent
-
-        for segment in options["segments"]:
-            segment_id_list[segment["id"]] = segment
-
-        for place in options["places"]:
-            place_id_list[place["id"]] = place
-
-        trip.leg_id_list = leg_id_list
-        trip.agent_id_list = agent_id_list
-        trip.segment_id_list = segment_id_list
-        trip.place_id_list = place_id_list
-        db.session.commit()
+        return show_flight_search(trip, search_id, table)
+    return render_template(url_for('tickets.html'))
 
-        #loop through the itinerary and format it for the html page
-        for option in options["itineraries"]:
-            #the id is the key, the option json is the val
-            itinerary_id_list[option["id"]] = option
-            itinerary = {
-                "id": "",
-                "leg1_departure": "",
-                "leg1_arrival": "",
-                "leg1_duration": 0,
-                "leg1_stop_count": 0,
-                "leg1_layover_list": [],
-                "leg2_departure": "",
-                "leg2_arrival": "",
-                "leg2_duration": 0,
-                "leg2_stop_count": 0,
-                "leg2_layover_list": [],
-                "price": 0.0,
-                "agent": "",
-                "url": "https://www.skyscanner.com"
-            }
-            #url and id
-            itinerary["url"] = itinerary["url"] + option["pricing_options"][0]["items"][0]["url"]
-            itinerary["id"] = option["id"]
-
-            #get leg 1 data
-            if leg_id_list[option["leg_ids"][0]]:
-                leg = leg_id_list[option["leg_ids"][0]]
-                itinerary["leg1_departure"] = leg["departure"]
-                itinerary["leg1_arrival"] = leg["arrival"]
-                itinerary["leg1_duration"] = int(leg["duration"])
-                itinerary["leg1_stop_count"] = leg["stop_count"]
-                
-                #get all of the segment data and layover information
-                if len(leg["segment_ids"]) > 1:
-                    layovers = []
-                    layover_duration = 0
-                    #find the difference between a segments arrival and departure to get layover
-                    for i in range(0, len(leg["segment_ids"]) - 1):
-                        if segment_id_list[leg["segment_ids"][i]]:
-                            segment1 = segment_id_list[leg["segment_ids"][i]]
-                            segment2 = segment_id_list[leg["segment_ids"][i + 1]]
-                            segment1_arrival = datetime.fromisoformat(segment1["arrival"])
-                            segment2_departure = datetime.fromisoformat(segment2["departure"])
-                            difference = segment2_departure - segment1_arrival
-                            difference = difference.total_seconds()
-                            hours = int(difference // 3600)
-                            mins = int((difference % 3600) / 60)
-                            layover_place = place_id_list[segment1["destination_place_id"]]["display_code"]
-                            formatted_layover = f"{hours}h {mins}m layover at {layover_place}"
-                            if len(layovers) > 0:
-                                formatted_layover = ", " + formatted_layover
-                            layovers.append(formatted_layover)
-                            layover_duration += (difference / 60)
-                        else:
-                            flash("Server error")
-                            return redirect(url_for("home"))
-                    #subtract the layover time from the total trip duration
-                    itinerary['leg1_duration'] -= int(layover_duration) 
-                    itinerary["leg1_layover_list"] = layovers
-            else:
-                flash("Server error")
-                return redirect(url_for("home"))
-
-            #same thing for leg 2
-            if leg_id_list[option["leg_ids"][1]]:
-                leg = leg_id_list[option["leg_ids"][1]]
-                itinerary["leg2_departure"] = leg["departure"]
-                itinerary["leg2_arrival"] = leg["arrival"]
-                itinerary["leg2_duration"] = leg["duration"]
-                itinerary["leg2_stop_count"] = leg["stop_count"]
-
-                if len(leg["segment_ids"]) > 1:
-                    layovers = []
-                    layover_duration = 0
-                    for i in range(0, len(leg["segment_ids"]) - 1):
-                        if segment_id_list[leg["segment_ids"][i]]:
-                            segment1 = segment_id_list[leg["segment_ids"][i]]
-                            segment2 = segment_id_list[leg["segment_ids"][i + 1]]
-                            segment1_arrival = datetime.fromisoformat(segment1["arrival"])
-                            segment2_departure = datetime.fromisoformat(segment2["departure"])
-                            difference = segment2_departure - segment1_arrival
-                            difference = difference.total_seconds()
-                            hours = int(difference // 3600)
-                            mins = int((difference % 3600) / 60)
-                            layover_place = place_id_list[segment1["destination_place_id"]]["display_code"]
-                            formatted_layover = f"{hours}h {mins}m layover at {layover_place}"
-                            if len(layovers) > 0:
-                                formatted_layover = ", " + formatted_layover
-                            layovers.append(formatted_layover)
-                            layover_duration += (difference / 60)
-                        else:
-                            flash("Server error")
-                            return redirect(url_for("home"))
-
-                    itinerary['leg2_duration'] -= int(layover_duration)                        
-                    itinerary["leg2_layover_list"] = layovers
-            else:
-                flash("Server error")
-                return redirect(url_for("home"))
-            #price
-            itinerary["price"] = option["cheapest_price"]["amount"] / trip.travelers
-            
-            #check if agent for flight is there
-            if agent_id_list[option["pricing_options"][0]["agent_ids"][0]]:
-                agent = agent_id_list[option["pricing_options"][0]["agent_ids"][0]]
-                itinerary["agent"] = agent["name"]
-            else:
-                print("error")
-
-            #append the entire itinerary information to the list
-            itinerary_list.append(itinerary)
-        trip.itinerary_id_list = itinerary_id_list
-        db.session.commit()
-        return render_template('tickets.html', logged_in=current_user.is_authenticated, trip=trip, url=base_url, itinerary_list=itinerary_list)
+async def find_tickets_async():
+    if request.method == "POST":
+        trip, key, start_date, end_date = start_flight_search(request.form)
+        try:
+            search_id, table = await flight_searches.get_or_load_async(key, lambda: search_flights_async(trip, start_date, end_date))
+        except FlightSearchError as error:
+            flash(str(error))
+            return redirect(url_for("home"))
+        except TimeoutError:
+            #the same search from another user is still running
+            flash("The flight search is taking too long, please try again")
+            return redirect(url_for("home"))
+        return show_flight_search(trip, search_id, table)
     return render_template(url_for('tickets.html'))
 
+#sort and filter options for the tickets page, taken from the query string
+def itinerary_filters(args):
+    filters = {
+        "sort": args.get("sort", "best"),
+        "descending": args.get("order") == "desc",
+        "max_stops": args.get("max_stops", type=int),
+        "agents": args.getlist("agent"),
+        "min_price": args.get("min_price", type=float),
+        "max_price": args.get("max_price", type=float),
+        "depart_after": None,
+        "depart_before": None
+    }
+    #times come in as HH:MM, the table works in minutes of the day
+    for name in ("depart_after", "depart_before"):
+        value = args.get(name)
+        if value:
+            try:
+                hours, mins = value.split(":")
+                filters[name] = int(hours) * 60 + int(mins)
+            except ValueError:
+                pass
+    return filters
+
+#column table for a search, built from the saved rows if it is not in memory
+def get_itinerary_table(trip):
+    table = itinerary_tables.get(trip.search_id)
+    if table is not None:
+        return table
+    itineraries = db.session.execute(db.select(Itinerary).where(Itinerary.search_id == trip.search_id).order_by(Itinerary.position))
+    legs = db.session.execute(db.select(Leg).where(Leg.search_id == trip.search_id))
+    segments = db.session.execute(db.select(Segment).where(Segment.search_id == trip.search_id))
+    itinerary_list = flatten(itineraries.scalars().all(), {leg.id: leg for leg in legs.scalars()},
+                             {segment.id: segment for segment in segments.scalars()}, trip.travelers)
+    return itinerary_tables.put(trip.search_id, ItineraryTable(itinerary_list))
+
+def render_tickets(trip, table):
+    filters = itinerary_filters(request.args)
+    rows, masks = table.select(**filters)
+    #keep the sort and filters in the page links
+    args = request.args.to_dict(flat=False)
+    args.pop("page", None)
+    pager = paginate(len(rows), request.args.get("page", 1, type=int), tickets_per_page, "show_tickets", trip_id=trip.id, **args)
+    itinerary_list = itinerary_cards(trip.search_id, [table.itineraries[row] for row in rows[pager["offset"]:pager["offset"] + pager["limit"]]])
+    return render_page('tickets.html', logged_in=current_user.is_authenticated, trip=trip, url=base_url, itinerary_list=itinerary_list,
+                       facets=table.facets(masks), filters=filters, total=len(rows), pager=pager)
+
+#itineraries with the legs part of their card, only the trip id in the select form differs between trips
+def itinerary_cards(search_id, itineraries):
+    render_legs = get_template_attribute("itinerary_card.html", "legs")
+    cards = []
+    for itinerary in itineraries:
+        key = ("itinerary", search_id, itinerary.id)
+        card = card_fragments.get(key)
+        if card is None:
+            card = card_fragments.put(key, {"legs": render_legs(itinerary)})
+        cards.append((itinerary, card))
+    return cards
+
+#re-sort or filter the tickets of a search without calling flightapi again
+@app.route("/tickets/<int:trip_id>", methods=["GET"])
+def show_tickets(trip_id):
+    trip = db.session.get(Trip, trip_id)
+    if trip is None or trip.search_id is None:
+        flash("Trip not found")
+        return redirect(url_for("home"))
+    return render_tickets(trip, get_itinerary_table(trip))
+
 #search for hotels
-def get_hotels(longitude, latitude):
-    url = "https://api.liteapi.travel/v3.0/data/hotels"
+def get_hotels(longitude, latitude, client=session):
+    url = liteapi_url + "/data/hotels"
     headers = {
         "X-API-Key": os.environ.get("LITEAPI_KEY"),
         "accept": "application/json"
@@ -516,12 +1183,12 @@ def get_hotels(longitude, latitude):
         "limit": 200,
         "radius": 10000
     }
-    response = session.get(url, params=params, headers=headers)
+    response = client.get(url, params=params, headers=headers)
     return response
 
 #get the prices for the hotels
-def get_hotel_offers(hotel_ids, check_in_date, check_out_date, occupants, iataCode):
-    url = "https://api.liteapi.travel/v3.0/hotels/rates"
+def get_hotel_offers(hotel_ids, check_in_date, check_out_date, occupants, iataCode, client=session):
+    url = liteapi_url + "/hotels/rates"
     headers = {
         "X-API-Key": os.environ.get("LITEAPI_KEY"),
         "accept": "application/json"
@@ -532,21 +1199,21 @@ def get_hotel_offers(hotel_ids, check_in_date, check_out_date, occupants, iataCo
         "checkout": check_out_date,
         "currency": "USD", 
         "timeout": 12,
-        "maxRatesPerHotel": 1,
-        "limit": 200,
+        "limit": len(hotel_ids),
         "hotelIds": hotel_ids,
         "occupancies": occupants,
         "iataCode": iataCode,
         "maxRatesPerHotel": 5,
+        "roomMapping": True,
         "radius": 10000
 
     }
-    response = session.post(url, json=payload, headers=headers)
+    response = client.post(url, json=payload, headers=headers)
     return response
 
 #get hotel details
-def get_hotel_details(hotel_id):
-    url = "https://api.liteapi.travel/v3.0/data/hotel"
+def get_hotel_details(hotel_id, client=session):
+    url = liteapi_url + "/data/hotel"
     headers = {
         "X-API-Key": os.environ.get("LITEAPI_KEY"),
         "accept": "application/json"
@@ -554,140 +1221,526 @@ def get_hotel_details(hotel_id):
     params = {
         "hotelId": hotel_id
     }
-    response = session.get(url, params=params, headers=headers)
+    response = client.get(url, params=params, headers=headers, timeout=hotel_details_timeout)
     return response
 
+#get hotel details for many hotels at once, with a cap on how many requests run at the same time
+#results keep the order of hotel_ids, hotels that fail or time out are left out
+def get_hotel_details_bulk(hotel_ids, max_workers=None):
+    details_id_list = {}
+    if len(hotel_ids) < 1:
+        return details_id_list
+    max_workers = max_workers or hotel_details_workers
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(hotel_ids))) as executor:
+        futures = [executor.submit(get_hotel_details, hotel_id) for hotel_id in hotel_ids]
+        for hotel_id, future in zip(hotel_ids, futures):
+            try:
+                details = future.result()
+                if details.status_code != 200:
+                    print(f"hotel details error {details.status_code} for {hotel_id}")
+                    continue
+                details_id_list[hotel_id] = details.json()
+            except (requests.RequestException, ValueError) as error:
+                print(f"hotel details error for {hotel_id}: {error}")
+    return details_id_list
+
+#same for async views, the connection pool of the async client caps how many run at once
+async def get_hotel_details_bulk_async(hotel_ids):
+    details_id_list = {}
+    responses = await asyncio.gather(*(get_hotel_details(hotel_id, client=async_session) for hotel_id in hotel_ids),
+                                     return_exceptions=True)
+    for hotel_id, details in zip(hotel_ids, responses):
+        try:
+            if isinstance(details, Exception):
+                raise details
+            if details.status_code != 200:
+                print(f"hotel details error {details.status_code} for {hotel_id}")
+                continue
+            details_id_list[hotel_id] = details.json()
+        except (requests.RequestException, ValueError) as error:
+            print(f"hotel details error for {hotel_id}: {error}")
+    return details_id_list
+
+
+#format one hotel for the hotels page from its list entry, price and details
+def format_hotel(id, listing, price, details):
+    hotel = {
+        "id": "",
+        "hotel_name": "",
+        "hotel_city": "",
+        "hotel_description": "",
+        "rating": 0.0,
+        "price": 0.0,
+        "photo1": "",
+        "photo2": "",
+        "photo3": "",
+        "hotel_amenities": "",
+        "check_in": "",
+        "check_out": "",
+        "photo_list": [],
+        "address": "",
+        "policies": [],
+        "reviews": 0
+    }
 
-@app.route("/search_hotels", methods=["POST", "GET"])
-def search_hotels():
-    if request.method == "POST":
-        trip_id = request.form.get("trip_id")
-        itinerary_id = request.form.get("itinerary_id")
-        #find trip in the database 
-        trip = db.session.execute(db.select(Trip).where(Trip.id == trip_id))
-        trip = trip.scalar()
-        trip.itinerary_id = itinerary_id
+    hotel["id"] = id
+    hotel["hotel_name"] = listing["name"]
+    hotel["hotel_description"] = listing["hotelDescription"]
+    hotel["hotel_city"] = listing["city"]
+    hotel["address"] = listing["address"]
+    try:
+        hotel["check_in"] = details["data"]["checkinCheckoutTimes"]["checkin"]
+        hotel["check_out"] = details["data"]["checkinCheckoutTimes"]["checkout"]
+    except KeyError:
+        hotel["check_in"] = "N/A"
+        hotel["check_out"] = "N/A"
 
-        db.session.commit() #update trip info
+    hotel["reviews"] = listing["reviewCount"]
 
-        #search for list of hotels
-        hotels = get_hotels(longitude=trip.destination_lon, latitude=trip.destination_lat)
-        hotels = hotels.json()
+    if listing["rating"] != 0:
+        hotel["rating"] = listing["rating"]
+    elif listing["stars"] != 0:
+        hotel["rating"] = listing["stars"] * 2
+    else:
+        hotel["rating"] = 0
 
-        hotel_id_list = {}
-        for hotel in hotels["data"]:
-            hotel_id_list[hotel["id"]] = hotel
+    hotel["price"] = price
+    hotel["photo1"] = listing["main_photo"]
 
-        #get checkin and checkout info and format
-        check_in_date = datetime.fromisoformat(trip.leg_id_list[trip.itinerary_id_list[trip.itinerary_id]["leg_ids"][0]]["arrival"])
-        check_out_date = datetime.fromisoformat(trip.leg_id_list[trip.itinerary_id_list[trip.itinerary_id]["leg_ids"][1]]["departure"])
+    try:
+        hotel["hotel_amenities"] = details["data"]["hotelFacilities"]
+    except KeyError:
+        print("key error")
 
-        trip.check_in_date = check_in_date
-        trip.check_out_date = check_out_date
-        
-        check_in_date = str(check_in_date.strftime("%Y-%m-%d"))
-        check_out_date = str(check_out_date.strftime("%Y-%m-%d"))
-        
-        db.session.commit()
+    try:
+        hotel["photo2"] = details["data"]["hotelImages"][1]["url"]
+        hotel["photo3"] = details["data"]["hotelImages"][2]["url"]
 
-        #get prices for hotels
-        occupants = [{"adults": trip.travelers}]
-        prices = get_hotel_offers(hotel_ids=hotels["hotelIds"], check_in_date=check_in_date, 
-                                  check_out_date=check_out_date, occupants=occupants,
-                                  iataCode=trip.destination)
-        prices = prices.json()
+        for photo in details["data"]["hotelImages"]:
+            hotel["photo_list"].append(photo["url"])
 
-        prices_id_list = {}
-        for price in prices["data"]:
-            # print(price["hotelId"])
-            prices_id_list[price["hotelId"]] = price
-
-        # print(prices_list)
-        # with open("prices.json", 'w') as json_file:
-        #     json.dump(prices_list, json_file, indent=4)
-        details_id_list = {}
-        for id in prices_id_list:
-            details = get_hotel_details(id)
-            details_id_list[id] = details.json()
-
-        trip.details_id_list = details_id_list
-        trip.hotel_id_list = hotel_id_list
-        trip.prices_id_list = prices_id_list
-        db.session.commit()
-        hotel_information_list = []
-        # 
-        # print(hotel_id_list["lp32b3e"]
-        # print(len(prices_id_list["lp32b3e"]))
-        # print(details_id_list["lp32b3e"])
-        # with open("details_id.json", 'w') as json_file:
-        #     json.dump(details_id_list["lp32b3e"], json_file, indent=4)
-                      
-        for id in prices_id_list:
-            hotel = {
-                "id": "",
-                "hotel_name": "",
-                "hotel_city": "",
-                "hotel_description": "",
-                "rating": 0.0,
-                "price": 0.0,
-                "photo1": "",
-                "photo2": "",
-                "photo3": "",
-                "hotel_amenities": "",
-                "check_in": "",
-                "check_out": "",
-                "photo_list": [],
-                "address": "",
-                "policies": [],
-                "reviews": 0
-            }
+        for policy in details["data"]["policies"]:
+            hotel["policies"].append(policy["description"])
+    except KeyError:
+        print("key error")
+
+    return hotel
 
-            hotel["id"] = id
-            hotel["hotel_name"] = hotel_id_list[id]["name"]
-            hotel["hotel_description"] = hotel_id_list[id]["hotelDescription"]
-            hotel["hotel_city"] = hotel_id_list[id]["city"]
-            hotel["address"] = hotel_id_list[id]["address"]
+#catalog writes of a request go into its transaction behind a savepoint, so hotels another
+#worker stored at the same time only undo the catalog write. background jobs have their own transaction
+@contextmanager
+def catalog_transaction():
+    if has_request_context():
+        with db.session.begin_nested():
+            yield db.session.connection()
+    else:
+        with db.engine.begin() as connection:
+            yield connection
+
+#databases whose insert can update the row it clashes with
+upsert_dialects = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+#save hotel details in the catalog, replacing older copies. returns the ids that were stored
+#hotels another worker is storing at the same time are updated rather than clashing with it
+def store_catalog(details_id_list):
+    if len(details_id_list) < 1:
+        return set()
+    now = datetime.now()
+    rows = [{"id": id, "details": details, "fetched_at": now} for id, details in details_id_list.items()]
+    upsert = upsert_dialects.get(db.engine.dialect.name)
+    if upsert is None:
+        return store_catalog_rows(rows)
+    statement = upsert(HotelCatalog)
+    statement = statement.on_conflict_do_update(index_elements=[HotelCatalog.id],
+                                                set_={"details": statement.excluded.details,
+                                                      "fetched_at": statement.excluded.fetched_at})
+    try:
+        with catalog_transaction() as connection:
+            connection.execute(statement, rows)
+    except SQLAlchemyError as error:
+        print(f"hotel catalog write failed for {len(rows)} hotels: {error}")
+        return set()
+    return set(details_id_list)
+
+#one row at a time for databases without an upsert, a row that clashes is updated instead
+def store_catalog_rows(rows):
+    stored = set()
+    for row in rows:
+        try:
             try:
-                hotel["check_in"] = details_id_list[id]["data"]["checkinCheckoutTimes"]["checkin"]
-                hotel["check_out"] = details_id_list[id]["data"]["checkinCheckoutTimes"]["checkout"]
-            except KeyError:
-                hotel["check_in"] = "N/A"
-                hotel["check_out"] = "N/A"
+                with catalog_transaction() as connection:
+                    connection.execute(insert(HotelCatalog), row)
+            except IntegrityError:
+                with catalog_transaction() as connection:
+                    connection.execute(update(HotelCatalog).where(HotelCatalog.id == row["id"])
+                                       .values(details=row["details"], fetched_at=row["fetched_at"]))
+        except SQLAlchemyError as error:
+            print(f"hotel catalog write failed for {row['id']}: {error}")
+            continue
+        stored.add(row["id"])
+    return stored
+
+#save the /data/hotels list entries next to the details of hotels already in the catalog
+#a failed write only leaves the older entries in place, the search goes on without it
+def store_catalog_summaries(hotel_id_list):
+    rows = [{"hotel": id, "new_summary": summary} for id, summary in hotel_id_list.items()]
+    if len(rows) < 1:
+        return
+    try:
+        with catalog_transaction() as connection:
+            connection.execute(update(HotelCatalog).where(HotelCatalog.id == bindparam("hotel"))
+                               .values(summary=bindparam("new_summary")), rows)
+    except SQLAlchemyError as error:
+        print(f"hotel catalog summary write failed for {len(rows)} hotels: {error}")
 
-            hotel["reviews"] = hotel_id_list[id]["reviewCount"]
+def refresh_catalog(hotel_ids):
+    try:
+        with app.app_context():
+            store_catalog(get_hotel_details_bulk(hotel_ids))
+    finally:
+        with catalog_lock:
+            catalog_refreshing.difference_update(hotel_ids)
+
+#fetch the hotel list around a destination and the details of the hotels on it while the user
+#is still picking flights, search_hotels then finds both in the api cache and the catalog
+def prefetch_hotels(latitude, longitude, cancelled):
+    with app.app_context():
+        hotels = get_hotels(longitude=longitude, latitude=latitude)
+        if hotels.status_code != 200:
+            return
+        hotels = hotels.json()
+        hotel_id_list = hotel_list(hotels)
+        for chunk in chunks(hotels["hotelIds"][:hotel_prefetch_details], hotel_details_workers * 2):
+            if cancelled.is_set():
+                return
+            available = ensure_catalog(chunk)
+            store_catalog_summaries({id: hotel_id_list[id] for id in available if id in hotel_id_list})
+
+def refresh_catalog_later(hotel_ids):
+    with catalog_lock:
+        hotel_ids = [id for id in hotel_ids if id not in catalog_refreshing]
+        catalog_refreshing.update(hotel_ids)
+    if len(hotel_ids) > 0:
+        catalog_executor.submit(refresh_catalog, hotel_ids)
+
+#make sure the catalog has details for these hotels, missing ones are fetched now and
+#old ones are refreshed in the background. returns the ids that have details
+def ensure_catalog(hotel_ids):
+    known, missing = check_catalog(hotel_ids)
+    if len(missing) > 0:
+        add_to_catalog(known, get_hotel_details_bulk(missing))
+    return set(known)
+
+async def ensure_catalog_async(hotel_ids):
+    known, missing = check_catalog(hotel_ids)
+    if len(missing) > 0:
+        add_to_catalog(known, await get_hotel_details_bulk_async(missing))
+    return set(known)
+
+#ids in the catalog and ids missing from it, old ones are queued for a refresh
+def check_catalog(hotel_ids):
+    rows = db.session.execute(db.select(HotelCatalog.id, HotelCatalog.fetched_at).where(HotelCatalog.id.in_(hotel_ids)))
+    known = {row.id: row.fetched_at for row in rows}
+    missing = [id for id in hotel_ids if id not in known]
+    stale = [id for id, fetched_at in known.items() if fetched_at < datetime.now() - hotel_catalog_max_age]
+    if len(stale) > 0:
+        refresh_catalog_later(stale)
+    return known, missing
+
+#only hotels that made it into the catalog count as known, load_catalog would not find the others
+def add_to_catalog(known, fetched):
+    known.update(dict.fromkeys(store_catalog(fetched), datetime.now()))
+
+#catalog rows for the given hotels, details are shaped like the /data/hotel response
+def load_catalog(hotel_ids):
+    rows = db.session.execute(db.select(HotelCatalog).where(HotelCatalog.id.in_(hotel_ids)))
+    return {row.id: row for row in rows.scalars()}
+
+#offer id of the cheapest room type with a rate for the chosen room, liteapi ties rates to the
+#rooms of /data/hotel through mappedRoomId. None when no rate is mapped to that room
+def room_offer(prices, room_id):
+    room_types = [room_type for room_type in prices["roomTypes"]
+                  if any(str(rate.get("mappedRoomId")) == str(room_id) for rate in room_type["rates"])]
+    if len(room_types) < 1:
+        return None
+    return min(room_types, key=room_rate)["offerId"]
+
+#the rates response of a trip's hotel search is kept in the api cache, not on the trip
+def store_hotel_rates(trip, content):
+    session.put_blob(f"hotel_rates:{trip.id}", content, hotel_rates_keep)
+
+#rates for one hotel of a trip's search, None once they have expired
+def load_hotel_rates(trip, hotel_id):
+    content = session.get_blob(f"hotel_rates:{trip.id}")
+    if content is None:
+        return None
+    if content.startswith(b"{"):
+        #saved as one json document before the rates were kept one hotel per line
+        for prices in json_codec.loads(content)["data"]:
+            if prices["hotelId"] == hotel_id:
+                return prices
+        return None
+    #only the line of the chosen hotel is decoded
+    return json_codec.decode_record(content, hotel_id)
+
+#start the rates requests for a trip's hotels, a chunk of hotel ids per request
+def request_hotel_rates(trip, hotel_ids, check_in_date, check_out_date):
+    occupants = [{"adults": trip.travelers}]
+    offers = dict(check_in_date=check_in_date, check_out_date=check_out_date, occupants=occupants, iataCode=trip.destination)
+    if async_session is not None:
+        async def fetch_async(chunk):
+            return rate_entries(await get_hotel_offers(hotel_ids=chunk, client=async_session, **offers))
+        return submit_chunks_async(async_session.background, fetch_async, hotel_ids, hotel_rates_chunk, hotel_rate_stats)
+
+    def fetch(chunk):
+        return rate_entries(get_hotel_offers(hotel_ids=chunk, **offers))
+    return submit_chunks(rates_executor, fetch, hotel_ids, hotel_rates_chunk, hotel_rate_stats)
+
+def rate_entries(response):
+    if response.status_code != 200:
+        raise requests.HTTPError(f"status {response.status_code}")
+    return response.json().get("data", [])
+
+#add a chunk of rates, true once the first page can be shown without waiting for the rest
+def add_rates(prices_id_list, entries):
+    for price in entries:
+        prices_id_list[price["hotelId"]] = price
+    return hotel_rates_early and len(prices_id_list) >= hotels_per_page
+
+def new_hotel_search(trip):
+    token = object()
+    with hotel_searches_lock:
+        hotel_searches[trip.id] = token
+    return token
+
+#save the priced hotels of a search on the trip, in the order liteapi listed them
+def save_hotel_rates(trip, hotel_order, hotel_id_list, prices_id_list, available):
+    store_hotel_rates(trip, json_codec.encode_records(prices_id_list))
+    store_catalog_summaries({id: hotel_id_list[id] for id in available if id in hotel_id_list})
+
+    #the trip only keeps which hotels were found and their prices
+    trip.hotel_ids = [id for id in hotel_order if id in prices_id_list and id in available and id in hotel_id_list]
+    trip.hotel_prices = {id: cheapest_rate(prices_id_list[id]) for id in trip.hotel_ids}
+    db.session.commit()
+    #ranked and filtered from this table until the next search
+    hotel_tables.put(trip.id, build_hotel_table(trip))
+
+#wait for the rest of a search's chunks and add their hotels to the trip,
+#unless a newer search for the same trip has started since
+#a search that has nothing left to save is forgotten, unless a newer one of the same trip replaced it
+def end_hotel_search(trip_id, token):
+    with hotel_searches_lock:
+        if hotel_searches.get(trip_id) is token:
+            del hotel_searches[trip_id]
+
+def finish_hotel_rates(trip_id, token, futures, hotel_order, hotel_id_list, prices_id_list):
+    #chunks already added come back done and are merged again
+    for entries in completed(futures):
+        add_rates(prices_id_list, entries)
+    with hotel_searches_lock:
+        if hotel_searches.get(trip_id) is not token:
+            return
+    try:
+        with app.app_context():
+            trip = db.session.get(Trip, trip_id)
+            if trip is not None:
+                save_hotel_rates(trip, hotel_order, hotel_id_list, prices_id_list, ensure_catalog(list(prices_id_list)))
+    finally:
+        end_hotel_search(trip_id, token)
+
+#facility names from a hotel's details
+def hotel_amenities(details):
+    return details.get("data", {}).get("hotelFacilities") or []
+
+#column table for a trip's hotels from the prices on the trip and the catalog rows
+def build_hotel_table(trip):
+    catalog = load_catalog(trip.hotel_ids)
+    listings = {id: row.summary for id, row in catalog.items() if row.summary}
+    amenities = {id: hotel_amenities(row.details) for id, row in catalog.items()}
+    return HotelTable([id for id in trip.hotel_ids if id in listings], listings, trip.hotel_prices, amenities,
+                      latitude=trip.destination_lat, longitude=trip.destination_lon)
+
+def get_hotel_table(trip):
+    table = hotel_tables.get(trip.id)
+    if table is not None:
+        return table
+    return hotel_tables.put(trip.id, build_hotel_table(trip))
+
+#sort and filter options for the hotels page, taken from the query string
+def hotel_filters(args):
+    order = args.get("order")
+    return {
+        "sort": args.get("sort", "best"),
+        "descending": None if order is None else order == "desc",
+        "min_price": args.get("min_price", type=float),
+        "max_price": args.get("max_price", type=float),
+        "amenities": args.getlist("amenity"),
+        "max_distance": args.get("max_distance", type=float)
+    }
 
-            if hotel_id_list[id]["rating"] != 0:
-                hotel["rating"] = hotel_id_list[id]["rating"]
-            elif hotel_id_list[id]["stars"] != 0:
-                hotel["rating"] = hotel_id_list[id]["stars"] * 2
-            else:
-                hotel["rating"] = 0
+def render_hotels(trip, table, loading=False):
+    filters = hotel_filters(request.args)
+    rows, masks = table.select(**filters)
+    #keep the sort and filters in the page links
+    args = request.args.to_dict(flat=False)
+    args.pop("page", None)
+    args.pop("trip_id", None)
+    pager = paginate(len(rows), request.args.get("page", 1, type=int), hotels_per_page, "search_hotels", trip_id=trip.id, **args)
+    page_rows = rows[pager["offset"]:pager["offset"] + pager["limit"]]
+    cards = hotel_cards([table.ids[row] for row in page_rows])
+    #the price and distance are the trip's, the rest of the card comes from the fragment cache
+    hotel_information_list = []
+    for row in page_rows:
+        id = table.ids[row]
+        if cards.get(id) is None:
+            continue
+        #hotels without coordinates have an infinite distance
+        distance = float(table.distance[row])
+        hotel_information_list.append({"id": id, "card": cards[id], "price": float(table.price[row]),
+                                       "distance": distance if distance != float("inf") else None})
+
+    return render_page("hotels.html", logged_in=current_user.is_authenticated, hotel_information_list=hotel_information_list, trip_id=trip.id,
+                       facets=table.facets(masks), filters=filters, total=len(rows), pager=pager, loading=loading)
+
+#fetch time of the catalog rows that have a listing, the version of their hotel's card
+def catalog_versions(hotel_ids):
+    rows = db.session.execute(db.select(HotelCatalog.id, HotelCatalog.fetched_at)
+                              .where(HotelCatalog.id.in_(hotel_ids), HotelCatalog.summary.is_not(None)))
+    return {row.id: row.fetched_at for row in rows}
+
+def hotel_card(id, catalog):
+    hotel = format_hotel(id, catalog.summary, None, catalog.details)
+    return {
+        "hotel_name": hotel["hotel_name"],
+        "hotel_city": hotel["hotel_city"],
+        "rating": hotel["rating"],
+        "photos": get_template_attribute("hotel_card.html", "photos")(hotel),
+        "more_info": get_template_attribute("hotel_card.html", "more_info")(hotel)
+    }
 
-            hotel["price"] = prices_id_list[id]["roomTypes"][0]["rates"][0]["retailRate"]["suggestedSellingPrice"][0]["amount"]
-            hotel["photo1"] = hotel_id_list[id]["main_photo"]
+#cards of a page of hotels, only hotels without a cached card have their details loaded from the catalog.
+#a refetch of the details changes the key, listing changes show once the old card expires
+def hotel_cards(hotel_ids):
+    versions = catalog_versions(hotel_ids)
+    cards = {id: card_fragments.get(("hotel", id, fetched_at)) for id, fetched_at in versions.items()}
+    missing = [id for id, card in cards.items() if card is None]
+    if len(missing) > 0:
+        for id, catalog in load_catalog(missing).items():
+            cards[id] = card_fragments.put(("hotel", id, catalog.fetched_at), hotel_card(id, catalog))
+    return cards
+
+#point the trip at the chosen itinerary and work out the hotel dates from it
+def start_hotel_search(form):
+    trip_id = form.get("trip_id")
+    itinerary_id = form.get("itinerary_id")
+    #find trip in the database 
+    trip = db.session.execute(db.select(Trip).where(Trip.id == trip_id))
+    trip = trip.scalar()
+    trip.itinerary_id = itinerary_id
+    #whatever the prefetch stored is used, the search fetches the rest itself
+    prefetcher.cancel(trip.id)
 
-            try:
-                hotel["hotel_amenities"] = details_id_list[id]["data"]["hotelFacilities"]
-            except KeyError:
-                print("key error")
+    #get checkin and checkout info and format
+    itinerary, legs, segments = load_itinerary(trip)
+    check_in_date = legs[0].arrival
+    check_out_date = legs[1].departure
 
-            try:
-                hotel["photo2"] = details_id_list[id]["data"]["hotelImages"][1]["url"]
-                hotel["photo3"] = details_id_list[id]["data"]["hotelImages"][2]["url"]
+    trip.check_in_date = check_in_date
+    trip.check_out_date = check_out_date
+    
+    check_in_date = str(check_in_date.strftime("%Y-%m-%d"))
+    check_out_date = str(check_out_date.strftime("%Y-%m-%d"))
+    #saved with the hotels found, in the search's one commit
+    return trip, check_in_date, check_out_date
+
+#the trip of an earlier hotel search, for later pages and re-sorting
+def saved_hotel_search(args):
+    trip_id = args.get("trip_id")
+    trip = db.session.get(Trip, trip_id) if trip_id else None
+    if trip is None or trip.hotel_ids is None:
+        return None
+    return trip
+
+def hotel_list(hotels):
+    hotel_id_list = {}
+    for hotel in hotels["data"]:
+        hotel_id_list[hotel["id"]] = hotel
+    return hotel_id_list
+
+@app.route("/search_hotels", methods=["POST", "GET"])
+def search_hotels():
+    if request.method == "POST":
+        trip, check_in_date, check_out_date = start_hotel_search(request.form)
 
-                for photo in details_id_list[id]["data"]["hotelImages"]:
-                    hotel["photo_list"].append(photo["url"])
+        #search for list of hotels
+        hotels = get_hotels(longitude=trip.destination_lon, latitude=trip.destination_lat)
+        hotels = hotels.json()
+        hotel_id_list = hotel_list(hotels)
 
-                for policy in details_id_list[id]["data"]["policies"]:
-                    hotel["policies"].append(policy["description"])
-            except KeyError:
-                print("key error")
+        #get prices for hotels
+        futures = request_hotel_rates(trip, hotels["hotelIds"], check_in_date, check_out_date)
+        token = new_hotel_search(trip)
 
-            hotel_information_list.append(hotel)
+        #show the first page once it can be filled, the slower chunks finish in the background
+        prices_id_list = {}
+        loading = False
+        for entries in completed(futures):
+            if add_rates(prices_id_list, entries):
+                loading = True
+                break
+
+        save_hotel_rates(trip, hotels["hotelIds"], hotel_id_list, prices_id_list, ensure_catalog(list(prices_id_list)))
+        if loading:
+            threading.Thread(target=finish_hotel_rates, args=(trip.id, token, futures, hotels["hotelIds"], hotel_id_list, prices_id_list),
+                             daemon=True).start()
+        else:
+            end_hotel_search(trip.id, token)
+    else:
+        #later pages of a search are built from what was saved on the trip
+        trip = saved_hotel_search(request.args)
+        if trip is None:
+            flash("Trip not found")
+            return redirect(url_for("home"))
+        loading = False
+
+    return render_hotels(trip, get_hotel_table(trip), loading=loading)
+
+async def search_hotels_async():
+    if request.method != "POST":
+        return search_hotels()
+
+    trip, check_in_date, check_out_date = start_hotel_search(request.form)
+    hotels = await get_hotels(longitude=trip.destination_lon, latitude=trip.destination_lat, client=async_session)
+    hotels = hotels.json()
+    hotel_id_list = hotel_list(hotels)
+
+    futures = request_hotel_rates(trip, hotels["hotelIds"], check_in_date, check_out_date)
+    token = new_hotel_search(trip)
+
+    prices_id_list = {}
+    loading = False
+    async for entries in completed_async(futures):
+        if add_rates(prices_id_list, entries):
+            loading = True
+            break
+
+    available = await ensure_catalog_async(list(prices_id_list))
+    save_hotel_rates(trip, hotels["hotelIds"], hotel_id_list, prices_id_list, available)
+    if loading:
+        threading.Thread(target=finish_hotel_rates, args=(trip.id, token, futures, hotels["hotelIds"], hotel_id_list, prices_id_list),
+                         daemon=True).start()
+    else:
+        end_hotel_search(trip.id, token)
+    return render_hotels(trip, get_hotel_table(trip), loading=loading)
 
-            
-    return render_template("hotels.html", logged_in=current_user.is_authenticated, hotel_information_list=hotel_information_list, trip_id=trip_id)
 
+#same urls and endpoint names, only the view functions change
+if serve_async:
+    app.view_functions["find_airport"] = find_airport_async
+    app.view_functions["find_tickets"] = find_tickets_async
+    app.view_functions["search_hotels"] = search_hotels_async
+    app.view_functions["register"] = register_async
+    app.view_functions["login"] = login_async
 
 @app.route("/choose_room/<trip_id>/<id>", methods=["GET"])
 def choose_room(id, trip_id):
@@ -697,8 +1750,13 @@ def choose_room(id, trip_id):
     trip = db.session.execute(db.select(Trip).where(Trip.id == trip_id))
     trip = trip.scalar()
 
-    rooms = trip.details_id_list[hotel_id]["data"]["rooms"]
-    prices = trip.prices_id_list[hotel_id]["roomTypes"]
+    catalog = load_catalog([hotel_id]).get(hotel_id)
+    if catalog is None:
+        flash("Hotel not found")
+        return redirect(url_for("home"))
+
+    details = catalog.details
+    rooms = details["data"]["rooms"]
     room_list = []
     hotel_information = {
         "id": "",
@@ -712,19 +1770,19 @@ def choose_room(id, trip_id):
     }
 
     hotel_information["id"] = hotel_id
-    hotel_information["description"] = trip.details_id_list[hotel_id]["data"]["hotelDescription"]
-    hotel_information["name"] = trip.details_id_list[hotel_id]["data"]["name"]
-    hotel_information["address"] = trip.details_id_list[hotel_id]["data"]["address"]
+    hotel_information["description"] = details["data"]["hotelDescription"]
+    hotel_information["name"] = details["data"]["name"]
+    hotel_information["address"] = details["data"]["address"]
     
     try:
-        hotel_information["pros"] = trip.details_id_list[hotel_id]["data"]["sentiment_analysis"]["pros"]
-        hotel_information["cons"] = trip.details_id_list[hotel_id]["data"]["sentiment_analysis"]["cons"]
-        for review in trip.details_id_list[hotel_id]["data"]["sentiment_analysis"]["categories"]:
+        hotel_information["pros"] = details["data"]["sentiment_analysis"]["pros"]
+        hotel_information["cons"] = details["data"]["sentiment_analysis"]["cons"]
+        for review in details["data"]["sentiment_analysis"]["categories"]:
             hotel_information["reviews"].append(review)
     except KeyError:
         print("error")
     
-    for photo in trip.details_id_list[hotel_id]["data"]["hotelImages"]:
+    for photo in details["data"]["hotelImages"]:
         hotel_information["photos"].append(photo["url"])
 
     for room in rooms:
@@ -767,76 +1825,22 @@ def review_trip(trip_id, hotel_id, room_id):
     trip = db.session.execute(db.select(Trip).where(Trip.id == trip_id))
     trip = trip.scalar()
 
-    option = trip.itinerary_id_list[trip.itinerary_id]
-    leg_id_list = trip.leg_id_list
-    agent_id_list = trip.agent_id_list
-    segment_id_list = trip.segment_id_list
-    place_id_list = trip.place_id_list
-    
-    itinerary = {
-                "id": "",
-                "leg1_departure": "",
-                "leg1_arrival": "",
-                "leg1_duration": 0,
-                "leg1_stop_count": 0,
-                "leg1_layover_list": [],
-                "leg2_departure": "",
-                "leg2_arrival": "",
-                "leg2_duration": 0,
-                "leg2_stop_count": 0,
-                "leg2_layover_list": [],
-                "price": 0.0,
-                "agent": "",
-                "url": "https://www.skyscanner.com"
-            }
-    
-    #url and id
-    itinerary["url"] = itinerary["url"] + option["pricing_options"][0]["items"][0]["url"]
-    itinerary["id"] = option["id"]
-
-    #get leg 1 data
-    if leg_id_list[option["leg_ids"][0]]:
-        leg = leg_id_list[option["leg_ids"][0]]
-        itinerary["leg1_departure"] = leg["departure"]
-        itinerary["leg1_arrival"] = leg["arrival"]
-        itinerary["leg1_duration"] = int(leg["duration"])
-        itinerary["leg1_stop_count"] = leg["stop_count"]
-
-        print(trip.segment_id_list)  
-        #get all of the segment data and layover information
-        if len(leg["segment_ids"]) > 1:
-            layovers = []
-            layover_duration = 0
-            #find the difference between a segments arrival and departure to get layover
-            for i in range(0, len(leg["segment_ids"]) - 1):
-                if segment_id_list[leg["segment_ids"][i]]:
-                    segment1 = segment_id_list[leg["segment_ids"][i]]
-                    segment2 = segment_id_list[leg["segment_ids"][i + 1]]
-                    segment1_arrival = datetime.fromisoformat(segment1["arrival"])
-                    segment2_departure = datetime.fromisoformat(segment2["departure"])
-                    difference = segment2_departure - segment1_arrival
-                    difference = difference.total_seconds()
-                    hours = int(difference // 3600)
-                    mins = int((difference % 3600) / 60)
-                    layover_place = place_id_list[segment1["destination_place_id"]]["display_code"]
-                    formatted_layover = f"{hours}h {mins}m layover at {layover_place}"
-                    if len(layovers) > 0:
-                        formatted_layover = ", " + formatted_layover
-                    layovers.append(formatted_layover)
-                    layover_duration += (difference / 60)
-                else:
-                    flash("Server error")
-                    return redirect(url_for("home"))
-            #subtract the layover time from the total trip duration
-            itinerary['leg1_duration'] -= int(layover_duration) 
-            itinerary["leg1_layover_list"] = layovers
-        else:
-            flash("Server error")
-            return redirect(url_for("home"))
-        
+    #the trip keeps references to what was picked, not copies of it
+    trip.hotel_id = hotel_id
+    trip.room_id = room_id
+    prices = load_hotel_rates(trip, hotel_id)
+    trip.offer_id = room_offer(prices, room_id) if prices is not None else None
+    db.session.commit()
 
-    
-    return render_template("review.html", logged_in=current_user.is_authenticated)
+    option, legs, segments = load_itinerary(trip)
+    try:
+        itinerary = flatten([option], {leg.id: leg for leg in legs}, segments, trip.travelers)[0]
+    except ItineraryError as error:
+        print(error)
+        flash("Server error")
+        return redirect(url_for("home"))
+
+    return render_template("review.html", logged_in=current_user.is_authenticated, itinerary=itinerary)
 
 if __name__ == "__main__":
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,120 @@
+import threading
+import time
+from contextlib import contextmanager
+
+#seconds, from a cached lookup to a slow supplier
+latency_buckets = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+#bytes, from a small json answer to a full rates response
+size_buckets = (1024, 10240, 102400, 524288, 1048576, 5242880, 20971520)
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "total", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        index = 0
+        while index < len(self.buckets) and value > self.buckets[index]:
+            index += 1
+        self.counts[index] += 1
+        self.total += value
+        self.count += 1
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def label_text(labels, extra=None):
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in pairs) + "}"
+
+#histograms and counters by name and labels, plus collectors that report the stats()
+#dicts the caches and pools already keep, rendered in the prometheus text format
+class Metrics:
+    def __init__(self):
+        self.histograms = {}
+        self.counters = {}
+        self.help = {}
+        self.collectors = []
+        self.lock = threading.Lock()
+
+    def describe(self, name, text):
+        self.help[name] = text
+
+    def observe(self, name, value, buckets=latency_buckets, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    #stats() is called when /metrics is read, every number in its dict becomes a gauge prefix_key,
+    #or a counter prefix_key_total for the keys listed in counters (hits, misses and other running counts).
+    #with a label, stats() returns one such dict per label value, like the api cache's per endpoint stats
+    def collect(self, prefix, stats, label=None, counters=()):
+        self.collectors.append((prefix, stats, label, frozenset(counters)))
+
+    def render(self):
+        lines = []
+        with self.lock:
+            histograms = sorted((key, histogram.buckets, list(histogram.counts), histogram.total, histogram.count)
+                                for key, histogram in self.histograms.items())
+            counters = sorted(self.counters.items())
+        described = set()
+        def header(name, kind):
+            if name not in described:
+                described.add(name)
+                if name in self.help:
+                    lines.append(f"# HELP {name} {self.help[name]}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), buckets, counts, total, count in histograms:
+            header(name, "histogram")
+            cumulative = 0
+            for bound, bucket_count in zip(buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{name}_bucket{label_text(labels, ('le', bound))} {cumulative}")
+            lines.append(f"{name}_bucket{label_text(labels, ('le', '+Inf'))} {count}")
+            lines.append(f"{name}_sum{label_text(labels)} {total}")
+            lines.append(f"{name}_count{label_text(labels)} {count}")
+        for (name, labels), value in counters:
+            header(name, "counter")
+            lines.append(f"{name}{label_text(labels)} {value}")
+        for prefix, stats, label, counter_keys in self.collectors:
+            try:
+                values = stats()
+            except Exception as error:
+                print(f"metrics collector {prefix} failed: {error}")
+                continue
+            #every series of a family has to be in one block, so the labelled dicts are regrouped by key
+            families = {}
+            groups = [(((label, name),), group) for name, group in sorted(values.items())] if label else [((), values)]
+            for labels, group in groups:
+                for key, value in group.items():
+                    if isinstance(value, (int, float)) and not isinstance(value, bool):
+                        families.setdefault(key, []).append((labels, value))
+            for key, series in families.items():
+                name, kind = (f"{prefix}_{key}_total", "counter") if key in counter_keys else (f"{prefix}_{key}", "gauge")
+                header(name, kind)
+                for labels, value in series:
+                    lines.append(f"{name}{label_text(labels)} {value}")
+        return "\n".join(lines) + "\n"
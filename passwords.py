@@ -0,0 +1,63 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.security import generate_password_hash, check_password_hash
+
+try:
+    import argon2
+except ImportError:
+    argon2 = None
+
+#password hashing with the method from the settings, run on its own pool sized to the cpu count.
+#the pool caps how many hashes run at once, so a login burst can't take every core from the
+#request threads waiting on upstream apis (hashlib's pbkdf2 and scrypt release the gil).
+#hash and verify still block their caller until the hash is done, the async views await
+#hash_async and verify_async instead, which leave the event loop free meanwhile.
+#method is anything werkzeug takes ("scrypt", "scrypt:65536:8:1", "pbkdf2:sha256:600000") or "argon2"
+class PasswordHasher:
+    def __init__(self, method="scrypt", salt_length=16, workers=None):
+        if method.startswith("argon2") and argon2 is None:
+            print("argon2-cffi is not installed, hashing passwords with scrypt instead")
+            method = "scrypt"
+        self.method = method
+        self.salt_length = salt_length
+        self.argon2 = argon2.PasswordHasher() if method.startswith("argon2") else None
+        #werkzeug writes the full parameters in front of the salt, e.g. scrypt:32768:8:1
+        self.prefix = None if self.argon2 else generate_password_hash("", method=method, salt_length=salt_length).split("$")[0]
+        self.executor = ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1)
+
+    def hash_now(self, password):
+        if self.argon2 is not None:
+            return self.argon2.hash(password)
+        return generate_password_hash(password, method=self.method, salt_length=self.salt_length)
+
+    #checks hashes of any method, so old ones keep working after the setting changes
+    def verify_now(self, stored, password):
+        if stored.startswith("$argon2"):
+            if argon2 is None:
+                return False
+            try:
+                return argon2.PasswordHasher().verify(stored, password)
+            except (argon2.exceptions.VerificationError, argon2.exceptions.InvalidHashError):
+                return False
+        return check_password_hash(stored, password)
+
+    #capped by the pool, the calling thread waits for the result
+    def hash(self, password):
+        return self.executor.submit(self.hash_now, password).result()
+
+    def verify(self, stored, password):
+        return self.executor.submit(self.verify_now, stored, password).result()
+
+    async def hash_async(self, password):
+        return await asyncio.wrap_future(self.executor.submit(self.hash_now, password))
+
+    async def verify_async(self, stored, password):
+        return await asyncio.wrap_future(self.executor.submit(self.verify_now, stored, password))
+
+    #true when a stored hash was made with other parameters than the current ones
+    def needs_rehash(self, stored):
+        if self.argon2 is not None:
+            return not stored.startswith("$argon2") or self.argon2.check_needs_rehash(stored)
+        parts = stored.split("$")
+        return len(parts) != 3 or parts[0] != self.prefix or len(parts[1]) != self.salt_length
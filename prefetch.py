@@ -0,0 +1,89 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+class Job:
+    __slots__ = ("future", "cancelled", "group")
+
+    def __init__(self, group):
+        self.future = None
+        self.cancelled = threading.Event()
+        self.group = group
+
+#speculative work done in the background before a page needs it
+#at most max_workers jobs run at once and at most max_pending wait or run, extra ones are dropped.
+#one job per key, a new job in a group cancels the group's previous one, and a cancelled
+#job that already started is told through the cancelled event it gets as a keyword argument
+class Prefetcher:
+    def __init__(self, max_workers=2, max_pending=32):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.max_pending = max_pending
+        self.jobs = {}
+        self.groups = {}
+        self.lock = threading.Lock()
+        self.submitted = 0
+        self.dropped = 0
+        self.cancelled = 0
+        self.failed = 0
+
+    def submit(self, key, fn, *args, group=None):
+        with self.lock:
+            previous = self.groups.get(group) if group is not None else None
+            if previous is not None and previous != key:
+                self._cancel(previous)
+            if key in self.jobs:
+                return False
+            if len(self.jobs) >= self.max_pending:
+                self.dropped += 1
+                return False
+            job = Job(group)
+            self.jobs[key] = job
+            if group is not None:
+                self.groups[group] = key
+            self.submitted += 1
+            job.future = self.executor.submit(self.run, key, job, fn, args)
+            return True
+
+    def run(self, key, job, fn, args):
+        try:
+            if not job.cancelled.is_set():
+                fn(*args, cancelled=job.cancelled)
+        except Exception as error:
+            with self.lock:
+                self.failed += 1
+            print(f"prefetch {key} failed: {error}")
+        finally:
+            with self.lock:
+                self._forget(key, job)
+
+    def cancel(self, key):
+        with self.lock:
+            return self._cancel(key)
+
+    def _cancel(self, key):
+        job = self.jobs.get(key)
+        if job is None:
+            return False
+        job.cancelled.set()
+        if job.future is not None:
+            job.future.cancel()
+        self._forget(key, job)
+        self.cancelled += 1
+        return True
+
+    def _forget(self, key, job):
+        #a cancelled job finishing late must not drop the job that replaced it
+        if self.jobs.get(key) is not job:
+            return
+        del self.jobs[key]
+        if job.group is not None and self.groups.get(job.group) == key:
+            del self.groups[job.group]
+
+    def stats(self):
+        with self.lock:
+            return {
+                "pending": len(self.jobs),
+                "submitted": self.submitted,
+                "dropped": self.dropped,
+                "cancelled": self.cancelled,
+                "failed": self.failed
+            }
@@ -0,0 +1,176 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+class Entry:
+    __slots__ = ("value", "size", "expires")
+
+    def __init__(self, value, size, expires):
+        self.value = value
+        self.size = size
+        self.expires = expires
+
+#set on a load whose leader was cancelled or exited before it finished
+class LoadAbandoned(Exception):
+    pass
+
+#cache for processed flight searches shared by every user
+#entries expire after ttl seconds (fares change), the least recently used ones are dropped
+#once the size estimated by sizeof goes over max_bytes or there are more than max_entries,
+#and only one caller loads a missing key. the others wait up to wait_timeout seconds for it,
+#then get a TimeoutError. without sizeof only max_entries bounds the cache
+class SearchCache:
+    def __init__(self, ttl=900, max_bytes=64 * 1024 * 1024, sizeof=None, max_entries=None, wait_timeout=60):
+        self.ttl = ttl
+        self.wait_timeout = wait_timeout
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.sized = sizeof is not None
+        self.sizeof = sizeof or (lambda value: 0)
+        self.entries = OrderedDict()
+        self.flights = {}
+        self.size = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0
+
+    def get(self, key):
+        with self.lock:
+            value = self._get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return value
+
+    def _get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires <= time.monotonic():
+            self._remove(key)
+            return None
+        self.entries.move_to_end(key)
+        return entry.value
+
+    def _remove(self, key):
+        entry = self.entries.pop(key)
+        self.size -= entry.size
+
+    def put(self, key, value):
+        size = self.sizeof(value)
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            if size > self.max_bytes:
+                return value
+            self.entries[key] = Entry(value, size, time.monotonic() + self.ttl)
+            self.size += size
+            while self.size > self.max_bytes or (self.max_entries is not None and len(self.entries) > self.max_entries):
+                self._remove(next(iter(self.entries)))
+        return value
+
+    def discard(self, key):
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+
+    #the cached value, or the future of the load in progress and whether the caller has to run it
+    def claim(self, key):
+        with self.lock:
+            value = self._get(key)
+            if value is not None:
+                self.hits += 1
+                return value, None, False
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                #one upstream call in progress, callers asking for the same key wait on it
+                flight = Future()
+                self.flights[key] = flight
+                self.misses += 1
+            else:
+                self.waits += 1
+            return None, flight, leader
+
+    def finish(self, key, flight, value=None, error=None):
+        if error is None:
+            self.put(key, value)
+        with self.lock:
+            del self.flights[key]
+        if error is None:
+            flight.set_result(value)
+        else:
+            flight.set_exception(error)
+
+    #return the cached value for key, or run loader once for everyone asking for it
+    #if the loader raises, every waiting caller gets the same error and nothing is cached.
+    #a leader that is cancelled or exits still releases the load, and a waiter takes it over
+    def get_or_load(self, key, loader):
+        while True:
+            value, flight, leader = self.claim(key)
+            if flight is None:
+                return value
+            if leader:
+                break
+            try:
+                return flight.result(timeout=self.wait_timeout)
+            except LoadAbandoned:
+                continue
+        try:
+            value = loader()
+        except Exception as error:
+            self.finish(key, flight, error=error)
+            raise
+        except BaseException:
+            self.finish(key, flight, error=LoadAbandoned())
+            raise
+        self.finish(key, flight, value)
+        return value
+
+    #same as get_or_load for async views, loader returns a coroutine and waiting
+    #does not block the event loop, sync and async callers share the same loads
+    async def get_or_load_async(self, key, loader):
+        while True:
+            value, flight, leader = self.claim(key)
+            if flight is None:
+                return value
+            if leader:
+                break
+            #asyncio.wait leaves the load running when this caller times out or is cancelled,
+            #the callback retrieves the outcome so asyncio does not report it as lost
+            waiting = asyncio.wrap_future(flight)
+            waiting.add_done_callback(lambda waiting: waiting.cancelled() or waiting.exception())
+            done, _ = await asyncio.wait([waiting], timeout=self.wait_timeout)
+            if not done:
+                raise TimeoutError(f"still loading after {self.wait_timeout} seconds")
+            try:
+                return waiting.result()
+            except LoadAbandoned:
+                continue
+        try:
+            value = await loader()
+        except Exception as error:
+            self.finish(key, flight, error=error)
+            raise
+        except BaseException:
+            self.finish(key, flight, error=LoadAbandoned())
+            raise
+        self.finish(key, flight, value)
+        return value
+
+    def stats(self):
+        with self.lock:
+            stats = {
+                "entries": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "waits": self.waits
+            }
+            #a cache bounded by entries has no size estimate to report
+            if self.sized:
+                stats["bytes"] = self.size
+            return stats
@@ -0,0 +1,148 @@
+import hashlib
+import hmac
+import io
+import os
+import threading
+import time
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+#width and height of every place a supplier photo is shown, None keeps the aspect ratio
+slots = {
+    "main": (215, 142), #hotel card with secondary photos
+    "main_tall": (215, 200), #hotel card without them
+    "thumb": (94, 58), #secondary photos on the hotel card
+    "modal": (465, None), #photos in the more info modal
+    "carousel": (450, 350), #hotel photos on the room page
+    "room": (200, 200) #room photos
+}
+
+#signature of a photo url and slot, so the proxy only fetches urls the app put on its pages
+def sign(key, url, slot):
+    return hmac.new(key, f"{slot}\n{url}".encode(), hashlib.sha256).hexdigest()[:32]
+
+def verify(key, url, slot, signature):
+    return hmac.compare_digest(sign(key, url, slot), signature)
+
+#images on disk named by the sha256 of their content, with a small ref file per name
+#(photo url and slot) pointing at the content. identical images from different urls are kept once
+#and the content hash is the etag. the least recently used files go once max_bytes is reached
+class ThumbnailStore:
+    def __init__(self, directory, max_bytes, sweep_interval=600):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.join(directory, "objects"), exist_ok=True)
+        os.makedirs(os.path.join(directory, "refs"), exist_ok=True)
+        if sweep_interval:
+            sweeper = threading.Thread(target=self.sweep_forever, args=(sweep_interval,), daemon=True)
+            sweeper.start()
+
+    def object_path(self, digest):
+        return os.path.join(self.directory, "objects", digest[:2], digest)
+
+    def ref_path(self, name):
+        return os.path.join(self.directory, "refs", hashlib.sha256(name.encode()).hexdigest())
+
+    #content hash and path of a stored image, None when it was never stored or has been evicted
+    def get(self, name):
+        try:
+            with open(self.ref_path(name)) as file:
+                digest = file.read().strip()
+            path = self.object_path(digest)
+            #used now, so the sweep keeps it longer
+            os.utime(path)
+            return digest, path
+        except (OSError, ValueError):
+            return None
+
+    def put(self, name, content):
+        digest = hashlib.sha256(content).hexdigest()
+        path = self.object_path(digest)
+        if not os.path.exists(path):
+            self.write(path, content)
+        self.write(self.ref_path(name), digest.encode())
+        return digest, path
+
+    #temp file and rename, readers only ever see whole files
+    def write(self, path, content):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp, "wb") as file:
+            file.write(content)
+        os.replace(temp, path)
+
+    #delete the least recently used images while the store is over max_bytes,
+    #then the refs whose image is gone
+    def sweep(self):
+        files = []
+        for folder, _, names in os.walk(os.path.join(self.directory, "objects")):
+            for name in names:
+                path = os.path.join(folder, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+        self.prune_refs()
+
+    def prune_refs(self):
+        folder = os.path.join(self.directory, "refs")
+        for name in os.listdir(folder):
+            path = os.path.join(folder, name)
+            try:
+                with open(path) as file:
+                    digest = file.read().strip()
+                if not os.path.exists(self.object_path(digest)):
+                    os.remove(path)
+            except OSError:
+                continue
+
+    def sweep_forever(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self.sweep()
+            except Exception as error:
+                print(f"thumbnail sweep failed: {error}")
+
+#download a photo, None when it fails or is bigger than max_bytes
+def fetch_image(session, url, max_bytes, timeout):
+    try:
+        with session.get(url, stream=True, timeout=timeout) as response:
+            if response.status_code != 200:
+                return None
+            content = bytearray()
+            for chunk in response.iter_content(64 * 1024):
+                content += chunk
+                if len(content) > max_bytes:
+                    return None
+            return bytes(content)
+    except Exception as error:
+        print(f"photo fetch failed for {url}: {error}")
+        return None
+
+#webp of the photo cropped to fill width x height, or scaled to width when height is None
+def make_thumbnail(content, width, height, quality=80):
+    with Image.open(io.BytesIO(content)) as image:
+        image = ImageOps.exif_transpose(image)
+        image = image.convert("RGBA" if image.mode in ("RGBA", "LA", "P") else "RGB")
+        if height is None:
+            if image.width > width:
+                image = image.resize((width, round(image.height * width / image.width)), Image.LANCZOS)
+        else:
+            image = ImageOps.fit(image, (width, height), Image.LANCZOS)
+        out = io.BytesIO()
+        image.save(out, "WEBP", quality=quality, method=4)
+        return out.getvalue()
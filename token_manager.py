@@ -0,0 +1,71 @@
+import os
+import threading
+import time
+import requests
+
+#keeps one amadeus access token for the whole app and refreshes it shortly before it expires
+#only one refresh runs at a time, other callers wait on it and then reuse the new token
+class TokenManager:
+    def __init__(self, url, client_id_env, client_secret_env, refresh_margin=60, timeout=10):
+        self.url = url
+        self.client_id_env = client_id_env
+        self.client_secret_env = client_secret_env
+        self.refresh_margin = refresh_margin
+        self.timeout = timeout
+        self.session = requests.Session() #pooled connection to the oauth endpoint
+        self.lock = threading.Lock() #held while a refresh is running
+        self.stats_lock = threading.Lock()
+        self.token = os.environ.get("AMADEUS_ACCESS_TOKEN")
+        #a token from the env file has an unknown expiry, keep it until amadeus rejects it
+        self.expires_at = float("inf") if self.token else 0.0
+        self.hits = 0
+        self.refreshes = 0
+        self.waits = 0
+
+    def is_fresh(self):
+        return self.token is not None and time.monotonic() < self.expires_at - self.refresh_margin
+
+    #return a valid token, refreshing it first if it is missing or about to expire
+    def get(self):
+        token = self.token
+        if self.is_fresh():
+            with self.stats_lock:
+                self.hits += 1
+            return token
+        return self.refresh(stale=token)
+
+    #get a new token, stale is the token the caller saw fail or expire
+    #if another caller already replaced it while we waited, that token is returned instead
+    def refresh(self, stale=None):
+        with self.lock:
+            if self.token != stale and self.is_fresh():
+                with self.stats_lock:
+                    self.waits += 1
+                return self.token
+
+            data = {
+                "grant_type": "client_credentials",
+                "client_id": os.environ.get(self.client_id_env),
+                "client_secret": os.environ.get(self.client_secret_env)
+            }
+            response = self.session.post(self.url, data=data, timeout=self.timeout)
+            print(f"amadeus token refresh {response.status_code}")
+            response.raise_for_status()
+            table = response.json()
+
+            self.token = table["access_token"]
+            self.expires_at = time.monotonic() + float(table.get("expires_in", 1799))
+            os.environ["AMADEUS_ACCESS_TOKEN"] = self.token
+            with self.stats_lock:
+                self.refreshes += 1
+            return self.token
+
+    #counters for monitoring how often the token is reused or refreshed
+    def stats(self):
+        with self.stats_lock:
+            return {
+                "hits": self.hits,
+                "refreshes": self.refreshes,
+                "waits": self.waits,
+                "expires_in": max(self.expires_at - time.monotonic(), 0) if self.token else 0
+            }